@@ -1,16 +1,35 @@
+import collections
 import datetime
+import functools
+import re
 import time
 import subprocess
-from pymongo import MongoClient
+import concurrent.futures
+import heapq
+import queue
+import selectors
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import socket
+from pymongo import MongoClient, CursorType, ReturnDocument
+from pymongo.errors import PyMongoError, CursorNotFound, CollectionInvalid
+from bson import ObjectId
 from azure.identity import ClientSecretCredential
 from azure.keyvault.secrets import SecretClient
 import json
+import orjson
 from dotenv import load_dotenv
 import os
 from cryptography.fernet import Fernet
 from google.cloud import secretmanager
 from google.oauth2 import service_account
 import base64
+import warnings
+
+# Cached once; datetime.datetime.now(UTC) replaces the deprecated utcnow(),
+# whose per-call DeprecationWarning does a stack walk on every tick.
+UTC = datetime.timezone.utc
+warnings.filterwarnings("once", category=DeprecationWarning, module="pymongo")
 
 # === LOGGING & DASHBOARD SETUP ===
 import logging
@@ -25,13 +44,6 @@ from logging_setup import setup_logging, log_success, log_error, log_info
 setup_logging()
 # dashboard = TriggerCompletionDashboard()
 
-# === LOGGING & DASHBOARD SETUP ===
-sys.path.append(os.path.join(os.path.dirname(__file__), 'AgentLog'))
-from logging_setup import setup_logging, log_success, log_error, log_info
-# from trigger_dashboard import TriggerCompletionDashboard
-setup_logging()
-# dashboard = TriggerCompletionDashboard()
-
 
 # === STEP 1: Conditionally write key to .env ===
 def append_key_to_env(env_file=".env", env_key="FERNET_KEY"):
@@ -40,41 +52,48 @@ def append_key_to_env(env_file=".env", env_key="FERNET_KEY"):
 
     if existing_key:
         print(f"✅ Key '{env_key}' already exists in {env_file}.")
-        return existing_key.encode()
+        # Older agents wrote the value wrapped in literal quotes; tolerate them.
+        return existing_key.strip("'\"").encode()
 
     new_key = Fernet.generate_key().decode()
 
     with open(env_file, "a") as file:
-        file.write(f"{env_key}={"'"+new_key+"'"}\n")
-        
+        file.write(f"{env_key}={new_key}\n")
 
     print(f"🆕 Fernet key appended to {env_file} as '{env_key}'")
     return new_key.encode()
 
 # === STEP 2: Load key from env ===
 def load_key_from_env(env_key="FERNET_KEY"):
-    load_dotenv()
+    # .env is already loaded once at import; don't re-parse the file here.
     key = os.environ.get(env_key)
     if not key:
         raise ValueError(f"⚠️ Key '{env_key}' not found in environment")
-    return key.encode()
+    return key.strip("'\"").encode()
 
 # === STEP 3: Encrypt ===
-def encrypt_message(message: str, key: bytes) -> bytes:
-    fernet = Fernet(key)
+def encrypt_message(message: str) -> bytes:
     return fernet.encrypt(message.encode())
 
 # === STEP 4: Decrypt ===
-def decrypt_message(token: bytes, key: bytes) -> str:
-    fernet = Fernet(key)
+def decrypt_message(token: bytes) -> str:
     return fernet.decrypt(token).decode()
 
 
-append_key_to_env()
-# Load the .env file
-load_dotenv()
-FERNET_SECRET_KEY = os.getenv("FERNET_KEY")
-fernet = Fernet(FERNET_SECRET_KEY)
+# append_key_to_env already ran load_dotenv once; no further .env re-parses.
+FERNET_KEY_BYTES = append_key_to_env()
+# Single Fernet instance for the whole agent; building one per decrypt pays the
+# base64 key parse + HMAC key schedule every time. Constructing it here also
+# fails fast at import on a malformed key instead of on the first decrypt.
+fernet = Fernet(FERNET_KEY_BYTES)
+
+
+def minute_floor_utc():
+    # Integer-truncate to the minute instead of utcnow().replace(second=0, ...):
+    # one datetime allocation instead of two, and no DeprecationWarning from
+    # utcnow() on 3.12+.
+    t = time.time_ns() // 60_000_000_000 * 60
+    return datetime.datetime.fromtimestamp(t, tz=UTC)
 
 
 print("🚀 MongoDB Trigger Watcher")
@@ -87,20 +106,58 @@ mongo_uri = "mongodb://localhost:27017/"
 db_name = "myDB"  # Replace with your database name
 env_collection_name = 'environmentOnboarding'
 triggers_collection_name = 'triggers'
-client = MongoClient(mongo_uri)
+client = MongoClient(mongo_uri, maxPoolSize=50, minPoolSize=5, serverSelectionTimeoutMS=3000)
 triggers_collection = client[db_name][triggers_collection_name]
 Enviroment_Collection = client[db_name][env_collection_name]
 
-def fetch_credentials(mongo_uri, db_name, collection_name, email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name):
-    
-    
-    # Connect to MongoDB
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    collection = db[collection_name]
-
-    # Query the collection
-    record = collection.find_one({
+# === SECRET CACHE ===
+# Key Vault / Secret Manager round-trips dominate fetch_credentials, and the
+# secrets don't rotate per-minute, so cache results in-process with a TTL.
+# (Plain dict + expiry rather than cachetools, which isn't a dependency here.)
+SECRET_CACHE_TTL_SECONDS = int(os.getenv("SECRET_CACHE_TTL_SECONDS", "600"))
+SECRET_CACHE_MAX_ENTRIES = 256
+_secret_cache = {}
+_secret_cache_lock = threading.Lock()
+
+# ClientSecretCredential caches its AAD token internally, so keeping the
+# SecretClient alive per (tenant, vault) skips the /oauth2/token round-trip
+# and TLS setup on every trigger inside the ~1h token lifetime.
+_sc_cache = {}
+
+# One Secret Manager client (one gRPC channel) per creds file; gRPC channels
+# are thread-safe and multiplex, so building a fresh client per trigger just
+# pays extra TCP + TLS handshakes.
+_SM_CLIENTS = {}
+
+def fetch_credentials(email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name):
+    cache_key = (cloud_name, email_to_find, managementUnit_Id, vault_name, secret_name)
+    now = time.monotonic()
+    with _secret_cache_lock:
+        entry = _secret_cache.get(cache_key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+    value = _fetch_credentials_uncached(email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name)
+    with _secret_cache_lock:
+        _secret_cache[cache_key] = (now + SECRET_CACHE_TTL_SECONDS, value)
+        # Bound the cache: drop expired entries first, then oldest-inserted,
+        # so offboarded environments can't pin secrets in memory forever.
+        if len(_secret_cache) > SECRET_CACHE_MAX_ENTRIES:
+            for key in [k for k, (expiry, _) in _secret_cache.items() if expiry <= now]:
+                del _secret_cache[key]
+            while len(_secret_cache) > SECRET_CACHE_MAX_ENTRIES:
+                del _secret_cache[next(iter(_secret_cache))]
+    return value
+
+# Service-account file reads (JSON parse + RSA key load) are invariant per
+# path, so memoize them.
+@functools.lru_cache(maxsize=64)
+def _gcp_credentials_from_file(auth_json_path):
+    return service_account.Credentials.from_service_account_file(auth_json_path)
+
+def _fetch_credentials_uncached(email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name):
+    # Reuse the module-level connection pool instead of opening a new client
+    # (and re-running server discovery) on every trigger.
+    record = Enviroment_Collection.find_one({
         "email": email_to_find,
         "cloudName": cloud_name,
         "managementUnitId": managementUnit_Id
@@ -126,12 +183,21 @@ def fetch_credentials(mongo_uri, db_name, collection_name, email_to_find, cloud_
             except Exception as e:
                 raise ValueError(f"Decryption failed for client_secret: {str(e)}")
 
-            credential = ClientSecretCredential(tenant_id, client_id, client_secret)
-            kv_client = SecretClient(vault_url=vault_url, credential=credential)
+            sc_key = (tenant_id, vault_url)
+            kv_client = _sc_cache.get(sc_key)
+            if kv_client is None:
+                credential = ClientSecretCredential(tenant_id, client_id, client_secret)
+                kv_client = SecretClient(vault_url=vault_url, credential=credential)
+                _sc_cache[sc_key] = kv_client
             secret_value = kv_client.get_secret(secret_name).value
-            secret_value = secret_value.replace('\\"', '"').replace("'", "")
 
-            secret_json = json.loads(secret_value)
+            # orjson: C parser, 2-5x faster than stdlib json on this hot auth
+            # path. Some vaults store the payload as a JSON-encoded string, so
+            # unwrap that extra level rather than scrubbing quotes with
+            # replace() (which mangled passwords containing apostrophes).
+            secret_json = orjson.loads(secret_value)
+            if isinstance(secret_json, str):
+                secret_json = orjson.loads(secret_json)
             username = secret_json.get("username")
             password = secret_json.get("password")
 
@@ -144,14 +210,17 @@ def fetch_credentials(mongo_uri, db_name, collection_name, email_to_find, cloud_
             project_id = managementUnit_Id
             AUTH_JSON_PATH = f"Creds//{project_id}_{secret_name}.json"
 
-            #  This key must have secretAccessor role
-            if not os.access(AUTH_JSON_PATH, os.R_OK):
-                print("No GCP Creds file found")
+            # Step 2: Get the Secret Manager client (named sm_client so it can't
+            # shadow the module-level MongoClient)
+            sm_client = _SM_CLIENTS.get(AUTH_JSON_PATH)
+            if sm_client is None:
+                #  This key must have secretAccessor role
+                if not os.access(AUTH_JSON_PATH, os.R_OK):
+                    print("No GCP Creds file found")
 
-            credentials = service_account.Credentials.from_service_account_file(AUTH_JSON_PATH)
-
-            # Step 2: Initialize Secret Manager client
-            client = secretmanager.SecretManagerServiceClient(credentials=credentials)
+                credentials = _gcp_credentials_from_file(AUTH_JSON_PATH)
+                sm_client = secretmanager.SecretManagerServiceClient(credentials=credentials)
+                _SM_CLIENTS[AUTH_JSON_PATH] = sm_client
 
             # Step 3: Define secret name
             
@@ -162,11 +231,11 @@ def fetch_credentials(mongo_uri, db_name, collection_name, email_to_find, cloud_
             secret_fullname = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
  
             # Step 4: Access the secret payload
-            response = client.access_secret_version(request={"name": secret_fullname})
+            response = sm_client.access_secret_version(request={"name": secret_fullname})
             secret_payload = response.payload.data.decode("UTF-8")
 
             # Step 5: Parse and use the service account JSON key
-            service_account_credentials = json.loads(secret_payload)
+            service_account_credentials = orjson.loads(secret_payload)
             creds = service_account_credentials
             client_email = creds.get("client_email")
             private_key= creds.get("private_key")
@@ -179,110 +248,608 @@ def fetch_credentials(mongo_uri, db_name, collection_name, email_to_find, cloud_
         raise ValueError(f"No record found for email: {email_to_find}")
 
 
-try:
-    Current_Email = None
+# === SCAN WORKER POOL ===
+# Scans are independent per environment, so dispatch them to a process pool and
+# let them run side by side instead of serially.
+SCAN_TIMEOUT_SECONDS = int(os.getenv("SCAN_TIMEOUT_SECONDS", "3600"))
+# In-process invocation skips interpreter startup and SDK re-imports per scan;
+# set SCAN_IN_PROCESS=0 to fall back to spawning python Azure.py / Gcp.py.
+SCAN_IN_PROCESS = os.getenv("SCAN_IN_PROCESS", "1") != "0"
+# Cap concurrent scans: past ~20-30 simultaneous cloud API sessions the
+# provider side starts throttling and latency degrades for everyone.
+SCAN_POOL_WORKERS = int(os.getenv("SCAN_POOL_WORKERS", str(min(20, os.cpu_count() or 4))))
+
+def _worker_init():
+    """Give each pool worker its own connections, then warm them.
+
+    Live clients must not cross the process boundary: an inherited gRPC
+    channel can hang after fork, a forked SecretClient shares its parent's
+    TCP connection, and pymongo is not fork-safe -- and under spawn the
+    parent's warm caches don't carry over at all. So drop anything
+    inherited and rebuild fresh inside the worker.
+    (prewarm_clients and the cache dicts resolve at call time, so defining
+    this above them is fine.)"""
+    global client, triggers_collection, Enviroment_Collection
+    _sc_cache.clear()
+    _SM_CLIENTS.clear()
+    with _secret_cache_lock:
+        _secret_cache.clear()
+    client = MongoClient(mongo_uri, maxPoolSize=50, minPoolSize=5, serverSelectionTimeoutMS=3000)
+    triggers_collection = client[db_name][triggers_collection_name]
+    Enviroment_Collection = client[db_name][env_collection_name]
+    try:
+        prewarm_clients()
+    except Exception as e:
+        log_error("Worker Init", str(e))
+
+POOL = ProcessPoolExecutor(max_workers=SCAN_POOL_WORKERS, initializer=_worker_init)
+
+# Invariant command prefixes for the subprocess fallback; only the per-trigger
+# args get appended.
+AZURE_CMD_PREFIX = ("python", "Azure.py")
+GCP_CMD_PREFIX = ("python", "Gcp.py")
+
+# The ~1.7KB private key is invariant per environment, so don't re-encode it
+# for argv on every fallback invocation.
+@functools.lru_cache(maxsize=64)
+def _b64_private_key(private_key):
+    return base64.b64encode(private_key.encode('utf-8')).decode('ascii')
+
+def _pump_pipe(pipe, logger, context):
+    for line in iter(pipe.readline, ''):
+        logger(f"{context} Script", line.rstrip())
+
+def _run_subprocess_scan(cmd, context):
+    # Stream the child's output line-by-line instead of buffering it all with
+    # capture_output: a long scan can emit tens of MB, and a full pipe buffer
+    # stalls the child. Logs also show up as the scan progresses. A selector
+    # multiplexes both pipes so stderr keeps its severity and neither pipe can
+    # deadlock the other -- except on Windows, where select() only handles
+    # sockets, so win32 drains each pipe on its own reader thread instead.
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True, encoding='utf-8', bufsize=1) as p:
+        watchdog = threading.Timer(SCAN_TIMEOUT_SECONDS, p.kill)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            if sys.platform == "win32":
+                readers = [
+                    threading.Thread(target=_pump_pipe, args=(p.stdout, log_info, context), daemon=True),
+                    threading.Thread(target=_pump_pipe, args=(p.stderr, log_error, context), daemon=True),
+                ]
+                for reader in readers:
+                    reader.start()
+                for reader in readers:
+                    reader.join()
+            else:
+                sel = selectors.DefaultSelector()
+                sel.register(p.stdout, selectors.EVENT_READ, log_info)
+                sel.register(p.stderr, selectors.EVENT_READ, log_error)
+                try:
+                    open_pipes = 2
+                    while open_pipes:
+                        for key, _ in sel.select():
+                            line = key.fileobj.readline()
+                            if line:
+                                key.data(f"{context} Script", line.rstrip())
+                            else:  # EOF on this pipe
+                                sel.unregister(key.fileobj)
+                                open_pipes -= 1
+                finally:
+                    sel.close()
+            rc = p.wait()
+        finally:
+            watchdog.cancel()
+    if rc != 0:
+        log_error(f"{context} Script", f"Exited with code {rc}")
+    return rc
+
+def run_scan(Environment, trigger):
+    """Worker: fetch credentials for one environment and run its cloud scan."""
+    cloud_name = Environment.get('cloudName')
+    tenant_id = Environment.get('rootId')
+    managementUnit_Id = Environment.get('managementUnitId')
+    vault_name = Environment.get('vaultname')
+    secret_name = Environment.get('secretname')
+    email_to_find = Environment.get('email')
+    if cloud_name == 'Azure':
+        log_info("Azure Script", "🔵 Running Azure script")
+        try:
+            username, password = fetch_credentials(email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name)
+            if SCAN_IN_PROCESS:
+                # Imported lazily so only worker processes pay the Azure SDK import cost
+                from Azure import run as run_azure
+                run_azure(client_id=username, client_secret=password, tenant_id=tenant_id,
+                          subscription_id=managementUnit_Id, email=email_to_find)
+            else:
+                cmd = [
+                    *AZURE_CMD_PREFIX,
+                    "--client_id", username,
+                    "--client_secret", password,
+                    "--subscription_id", managementUnit_Id,
+                    "--email", email_to_find,
+                    "--tenant_id", tenant_id,
+                ]
+                _run_subprocess_scan(cmd, "Azure")
+            log_success("Azure Script Execution", "Completed successfully")
+        except Exception as e:
+            log_error("Azure Script Execution", str(e))
+    elif cloud_name == 'GCP':
+        log_info("GCP Script", "🟡 Running GCP script")
+        try:
+            project_id, client_email, private_key = fetch_credentials(email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name)
+            if SCAN_IN_PROCESS:
+                from Gcp import run as run_gcp
+                run_gcp(client_email=client_email, private_key=private_key,
+                        project_id=project_id, user_email=email_to_find)
+            else:
+                encoded_key = _b64_private_key(private_key)
+                cmd = [
+                    *GCP_CMD_PREFIX,
+                    "--client_email", client_email,
+                    "--private_key", encoded_key,
+                    "--project_id", project_id,
+                    "--user_email", email_to_find
+                ]
+                _run_subprocess_scan(cmd, "GCP")
+            log_success("GCP Script Execution", "Completed successfully")
+        except Exception as e:
+            log_error("GCP Script Execution", str(e))
+    else:
+        log_error("Unknown CloudName", f"{cloud_name}")
+
+
+# Only the fields the dispatch path actually reads; onboarding docs and
+# triggers otherwise ship their full payload over the wire per lookup.
+ENV_PROJECTION = {"cloudName": 1, "rootId": 1, "managementUnitId": 1,
+                  "srvaccntName": 1, "srvacctPass": 1, "vaultname": 1,
+                  "secretname": 1, "email": 1}
+TRIGGER_PROJECTION = {"email": 1, "ScheduledTimeStamp": 1, "Status": 1, "worker_id": 1}
+
+
+def _environments_by_email(emails):
+    """One $in query + one index range scan instead of a point lookup per trigger."""
+    by_email = collections.defaultdict(list)
+    for env in Enviroment_Collection.find({"email": {"$in": list(emails)}}, ENV_PROJECTION).sort("_id"):
+        by_email[env["email"]].append(env)
+    return by_email
+
+
+def handle_trigger(trigger, environments=None):
+    """Process one Pending trigger: look up its environments, dispatch the scans, mark Completed."""
+    log_info("Trigger ID", f"{trigger.get('_id')}")
+    log_info("Scheduled", f"{trigger.get('ScheduledTimeStamp')}")
+    Current_Email = trigger.get('email')
+    # Check users collection for CloudName
+    if environments is None:
+        # Iterate the cursor lazily instead of list()-ing it, so the first scan
+        # is submitted before the last environment document has even arrived.
+        environments = Enviroment_Collection.find({"email": Current_Email}, ENV_PROJECTION).sort("_id").batch_size(200)
+    futures = [POOL.submit(run_scan, Environment, trigger) for Environment in environments]
+    if futures:
+        # as_completed surfaces each worker's failure the moment it finishes
+        # instead of sitting silent until the slowest scan in the batch is done.
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is not None:
+                log_error("Scan Worker", str(future.exception()))
+    else:
+        log_error("Environment Lookup", "No Environment found in environmentOnboarding collection")
+
+    _mark_completed(trigger["_id"])
+
+
+# === COMPLETION BATCHING ===
+# Completed ids are buffered and flushed with one update_many instead of paying
+# one round-trip per trigger.
+_completed_ids = []
+_completed_lock = threading.Lock()
+COMPLETED_FLUSH_SIZE = 100
+
+def _mark_completed(trigger_id):
+    with _completed_lock:
+        _completed_ids.append(trigger_id)
+
+def flush_completed():
+    with _completed_lock:
+        if not _completed_ids:
+            return
+        ids = _completed_ids[:]
+        _completed_ids.clear()
+    ScanCompletedTime = minute_floor_utc()
+    try:
+        triggers_collection.update_many(
+            {"_id": {"$in": ids}},
+            {"$set": {"Status": "Completed", "ScanCompletedTime": ScanCompletedTime}},
+        )
+    except PyMongoError:
+        # Put the ids back so the next flush retries them instead of leaving
+        # the triggers stuck in Running forever.
+        with _completed_lock:
+            _completed_ids.extend(ids)
+        raise
+    print(f"✅ Updated {len(ids)} trigger(s) to Completed state")
+    log_success("Trigger Update", f"Updated {len(ids)} trigger(s) to Completed state")
+
+
+# === FUTURE-SCHEDULED TRIGGERS ===
+# Triggers whose ScheduledTimeStamp is still in the future go onto a small in-memory
+# heap and are fired by a threading.Timer armed for the earliest deadline.
+_schedule_heap = []
+_schedule_lock = threading.Lock()
+_schedule_timer = None
+_schedule_timer_deadline = None
+
+def _fire_due_triggers():
+    global _schedule_timer, _schedule_timer_deadline
+    now = datetime.datetime.now(UTC)
+    due = []
+    with _schedule_lock:
+        _schedule_timer = None
+        _schedule_timer_deadline = None
+        while _schedule_heap and _schedule_heap[0][0] <= now:
+            due.append(heapq.heappop(_schedule_heap)[2])
+    for trigger in due:
+        # Hand due triggers back to the consumer thread instead of running the
+        # scan inside the timer thread.
+        trigger_queue.put(trigger)
+    _arm_schedule_timer()
+
+def _arm_schedule_timer():
+    global _schedule_timer, _schedule_timer_deadline
+    with _schedule_lock:
+        if not _schedule_heap:
+            return
+        earliest = _schedule_heap[0][0]
+        if _schedule_timer is not None:
+            if _schedule_timer_deadline is not None and _schedule_timer_deadline <= earliest:
+                return
+            # The new heap top is due before the armed deadline; without a
+            # re-arm it would not fire until the old (later) timer elapsed.
+            _schedule_timer.cancel()
+        now = datetime.datetime.now(UTC)
+        delay = max((earliest - now).total_seconds(), 0)
+        _schedule_timer = threading.Timer(delay, _fire_due_triggers)
+        _schedule_timer.daemon = True
+        _schedule_timer.start()
+        _schedule_timer_deadline = earliest
+
+def _as_utc(ts):
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=UTC)
+    return ts
+
+def dispatch_trigger(trigger, environments=None):
+    """Run the trigger now if it is due, otherwise park it on the schedule heap.
+
+    Due triggers are claimed atomically (Pending -> Running) before the scan so
+    another agent instance cannot double-execute them. Future triggers stay
+    Pending while parked so a sibling can still pick them up if we die."""
+    now = datetime.datetime.now(UTC)
+    scheduled = trigger.get("ScheduledTimeStamp")
+    if scheduled is not None and _as_utc(scheduled) > now:
+        with _schedule_lock:
+            heapq.heappush(_schedule_heap, (_as_utc(scheduled), str(trigger["_id"]), trigger))
+        _arm_schedule_timer()
+        log_info("Trigger Scheduled", f"{trigger['_id']} parked until {scheduled}")
+    else:
+        if not (trigger.get("Status") == "Running" and trigger.get("worker_id") == WORKER_ID):
+            claimed = _claim_trigger(trigger["_id"], now)
+            if claimed is None:
+                log_info("Trigger Claim", f"{trigger['_id']} already claimed elsewhere, skipping")
+                return
+            trigger = claimed
+        handle_trigger(trigger, environments)
+
+
+# Cursor tuning: let the server batch events per getMore and block briefly before
+# returning an empty batch, trading a little idle latency for far fewer round-trips
+# under bursts. Both knobs are operator-tunable via env vars.
+TRIGGER_BATCH_SIZE = int(os.getenv("TRIGGER_BATCH_SIZE", "500"))
+TRIGGER_AWAIT_MS = int(os.getenv("TRIGGER_AWAIT_MS", "500"))
+
+# === CAPPED EVENTS COLLECTION ===
+# Writers (the /triggers route) append a tiny {_id: trigger_id} marker into the
+# capped trigger_events collection whenever a Pending trigger is inserted. Tailing
+# that small collection is much cheaper server-side than an oplog-wide change
+# stream when several agent instances run at once.
+TRIGGER_EVENTS_SIZE_BYTES = 10 * 1024 * 1024
+
+def ensure_trigger_events_collection():
+    try:
+        client[db_name].create_collection("trigger_events", capped=True, size=TRIGGER_EVENTS_SIZE_BYTES)
+        log_info("Trigger Events", "Created capped trigger_events collection")
+    except CollectionInvalid:
+        # Exists -- but if a marker arrived before any agent ever ran, MongoDB
+        # auto-created the collection uncapped and a tailable cursor can never
+        # follow it. Recreate it capped; markers are transient pointers and
+        # process_backlog re-claims any Pending triggers they referenced.
+        if not client[db_name]["trigger_events"].options().get("capped"):
+            log_info("Trigger Events", "trigger_events exists but is not capped; recreating")
+            client[db_name]["trigger_events"].drop()
+            client[db_name].create_collection("trigger_events", capped=True, size=TRIGGER_EVENTS_SIZE_BYTES)
+            log_info("Trigger Events", "Recreated trigger_events as a capped collection")
+
+trigger_events_collection = client[db_name]["trigger_events"]
+
+
+# === ATOMIC CLAIMS ===
+# Triggers are claimed with find_one_and_update (Pending -> Running) so two
+# agent instances can never double-execute the same scan. A janitor thread
+# sweeps Running docs whose claim went stale (worker crash) back to Pending.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+CLAIM_TIMEOUT_SECONDS = SCAN_TIMEOUT_SECONDS + 300
+# Hoisted so the janitor loop doesn't rebuild the timedelta every sweep.
+CLAIM_TIMEOUT_DELTA = datetime.timedelta(seconds=CLAIM_TIMEOUT_SECONDS)
+JANITOR_INTERVAL_SECONDS = 60
+
+def _claim_trigger(trigger_id, now):
+    return triggers_collection.find_one_and_update(
+        {"_id": trigger_id, "Status": "Pending"},
+        {"$set": {"Status": "Running", "worker_id": WORKER_ID, "claimed_at": now}},
+        projection=TRIGGER_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+
+def _pid_alive(pid):
+    """True if a process with this pid is running on this host."""
+    if sys.platform == "win32":
+        # os.kill(pid, 0) on Windows *terminates* the target, so probe via
+        # OpenProcess instead.
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if handle:
+            ctypes.windll.kernel32.CloseHandle(handle)
+            return True
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def requeue_interrupted_claims():
+    """Re-enqueue Running triggers left behind by a dead agent on this host.
+
+    If an agent died between claiming (Pending -> Running) and the Completed
+    flush, those docs stay Running forever and the scans never re-run. Only
+    claims whose worker pid is no longer alive are touched: sibling agents on
+    this host keep theirs, and claims from other hosts are left alone (the
+    staleness janitor covers those)."""
+    host_prefix = socket.gethostname() + ":"
+    workers = triggers_collection.distinct(
+        "worker_id", {"Status": "Running", "worker_id": {"$regex": f"^{re.escape(host_prefix)}"}}
+    )
+    dead_workers = []
+    for worker_id in workers:
+        try:
+            pid = int(worker_id.rsplit(":", 1)[1])
+        except (IndexError, ValueError):
+            dead_workers.append(worker_id)  # malformed; nothing can own it
+            continue
+        # Our own pid on a claim predating this process means the pid was
+        # recycled -- we just started, so the claim can't be ours.
+        if pid == os.getpid() or not _pid_alive(pid):
+            dead_workers.append(worker_id)
+    if not dead_workers:
+        return
+    result = triggers_collection.update_many(
+        {"Status": "Running", "worker_id": {"$in": dead_workers}},
+        {"$set": {"Status": "Pending"}, "$unset": {"worker_id": "", "claimed_at": ""}},
+    )
+    if result.modified_count:
+        log_info("Startup", f"Re-enqueued {result.modified_count} interrupted Running trigger(s)")
+
+def requeue_stale_claims():
     while True:
-        # Get current timestamp and one minute ago (your exact logic)
-        now = datetime.datetime.utcnow().replace(second=0, microsecond=0, tzinfo=datetime.timezone.utc)
-        one_minute_ago = now - datetime.timedelta(minutes=1)
-        
-        # Find triggers matching your exact criteria
-        triggers = list(triggers_collection.find({
-            "Status": "Pending",
-            "ScheduledTimeStamp": {
-                "$lte": now
-            },
-            
-            
-        }))
-        
-        
-        
-    
-        # Print message if triggers found
-        Current_Email = None
-        if triggers:
-            log_success("Trigger Detection", f"Found {len(triggers)} trigger(s) at {now.isoformat()}")
-            for trigger in triggers:
-                log_info("Trigger ID", f"{trigger.get('_id')}")
-                log_info("Scheduled", f"{trigger.get('ScheduledTimeStamp')}")
-                Current_Email = trigger.get('email')
-                # Check users collection for CloudName
-                Environment_List = list(Enviroment_Collection.find({"email": Current_Email}).sort("_id"))
-                if Environment_List:
-                    for Environment in Environment_List:
-                        cloud_name = Environment.get('cloudName')
-                        tenant_id = Environment.get('rootId')
-                        managementUnit_Id = Environment.get('managementUnitId')
-                        client_id = Environment.get('srvaccntName')
-                        client_secret = Environment.get('srvacctPass')
-                        vault_name = Environment.get('vaultname')
-                        secret_name = Environment.get('secretname')
-                        email_to_find = Environment.get('email')
-                        if cloud_name == 'Azure':
-                            log_info("Azure Script", "🔵 Running Azure script")
-                            try:
-                                username, password = fetch_credentials(mongo_uri, db_name, env_collection_name, email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name)
-                                cmd = [
-                                    "python", "Azure.py",
-                                    "--client_id", username,
-                                    "--client_secret", password,
-                                    "--subscription_id", managementUnit_Id,
-                                    "--email", email_to_find,
-                                    "--tenant_id", tenant_id,
-                                ]
-                                result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
-                                log_success("Azure Script Execution", "Completed successfully")
-                            except Exception as e:
-                                log_error("Azure Script Execution", str(e))
-                        elif cloud_name == 'GCP':
-                            log_info("GCP Script", "🟡 Running GCP script")
-                            try:
-                                project_id, client_email, private_key = fetch_credentials(mongo_uri, db_name, env_collection_name, email_to_find, cloud_name, managementUnit_Id, vault_name, secret_name)
-                                encoded_key = base64.b64encode(private_key.encode('utf-8')).decode('ascii')
-                                cmd = [
-                                    "python", "Gcp.py",
-                                    "--client_email", client_email,
-                                    "--private_key", encoded_key,
-                                    "--project_id", project_id,
-                                    "--user_email", email_to_find
-                                ]
-                                result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
-                                log_success("GCP Script Execution", "Completed successfully")
-                                log_info("GCP Script Output", result.stdout)
-                                if result.stderr:
-                                    log_error("GCP Script Error", result.stderr)
-                            except Exception as e:
-                                log_error("GCP Script Execution", str(e))
-                        else:
-                            log_error("Unknown CloudName", f"{cloud_name}")
-                else:
-                    log_error("Environment Lookup", "No Environment found in environmentOnboarding collection")
-        else:
-            log_info("Trigger Polling", f"No triggers found at {now.isoformat()}")
-        
-        ScanCompletedTime = datetime.datetime.utcnow().replace(second=0, microsecond=0, tzinfo=datetime.timezone.utc)
-        
-        # Update Triggers to Completed State
-        if triggers:
-            for trigger in triggers:
-                triggers_collection.update_one(
-                    {"_id": trigger["_id"]},
-                    {"$set": {"Status": "Completed", "ScanCompletedTime": ScanCompletedTime}},
-                
+        time.sleep(JANITOR_INTERVAL_SECONDS)
+        try:
+            cutoff = datetime.datetime.now(UTC) - CLAIM_TIMEOUT_DELTA
+            result = triggers_collection.update_many(
+                {"Status": "Running", "claimed_at": {"$lt": cutoff}},
+                {"$set": {"Status": "Pending"}, "$unset": {"worker_id": "", "claimed_at": ""}},
             )
-            print(f"✅ Updated {len(triggers)} trigger(s) to Completed state")
-            log_success("Trigger Update", f"Updated {len(triggers)} trigger(s) to Completed state")
-        # Wait 30 seconds
-        time.sleep(1)
-        # Show dashboard after each trigger batch if Current_Email is set
-        # if Current_Email is not None:
-        #     dashboard.show_trigger_completion_dashboard(Current_Email, operations_summary=None)
-        
-except KeyboardInterrupt:
-    print("\n⚠️ Stopped by user")
-except KeyboardInterrupt:
-    log_info("Agent", "Stopped by user")
-#finally:
+            if result.modified_count:
+                log_info("Janitor", f"Re-enqueued {result.modified_count} stale Running trigger(s)")
+        except PyMongoError as e:
+            log_error("Janitor", str(e))
+
+def prewarm(env):
+    """Build (and probe) the secret client for one onboarded environment so the
+    first real scan skips the TCP+TLS handshake and token round-trip."""
+    cloud_name = env.get("cloudName")
+    if cloud_name == "Azure":
+        tenant_id = env.get("rootId")
+        vault_url = f"https://{env.get('vaultname')}.vault.azure.net/"
+        sc_key = (tenant_id, vault_url)
+        if sc_key in _sc_cache:
+            return
+        client_id = fernet.decrypt(env["srvaccntName"].encode()).decode()
+        client_secret = fernet.decrypt(env["srvacctPass"].encode()).decode()
+        credential = ClientSecretCredential(tenant_id, client_id, client_secret)
+        kv_client = SecretClient(vault_url=vault_url, credential=credential)
+        # Cheap probe forces the AAD token fetch + TLS session now.
+        next(iter(kv_client.list_properties_of_secrets()), None)
+        _sc_cache[sc_key] = kv_client
+    elif cloud_name == "GCP":
+        project_id = env.get("managementUnitId")
+        auth_json_path = f"Creds//{project_id}_{env.get('secretname')}.json"
+        if auth_json_path in _SM_CLIENTS or not os.access(auth_json_path, os.R_OK):
+            return
+        credentials = _gcp_credentials_from_file(auth_json_path)
+        sm_client = secretmanager.SecretManagerServiceClient(credentials=credentials)
+        # Cheap probe forces gRPC channel setup now.
+        sm_client.list_secrets(request={"parent": f"projects/{project_id}", "page_size": 1})
+        _SM_CLIENTS[auth_json_path] = sm_client
+
+def prewarm_clients():
+    """Warm the secret-client caches for every onboarded environment.
+
+    Runs inside each pool worker (via _worker_init) so every worker owns its
+    own freshly built clients; live connections are never shared across the
+    process boundary."""
+    projection = {"cloudName": 1, "rootId": 1, "vaultname": 1, "managementUnitId": 1,
+                  "secretname": 1, "srvaccntName": 1, "srvacctPass": 1}
+    for env in Enviroment_Collection.find({}, projection):
+        try:
+            prewarm(env)
+        except Exception as e:
+            log_error("Prewarm", f"{env.get('managementUnitId')}: {e}")
+
+def ensure_indexes():
+    try:
+        # B-tree range scan on (Status, ScheduledTimeStamp) instead of a collection
+        # scan for the backlog sweep.
+        triggers_collection.create_index([("Status", 1), ("ScheduledTimeStamp", 1)], background=True)
+        # TTL-expire Completed docs after 7 days so the hot index range stays
+        # O(recent triggers) instead of growing with the collection's lifetime.
+        triggers_collection.create_index(
+            "ScanCompletedTime",
+            expireAfterSeconds=7 * 86400,
+            partialFilterExpression={"Status": "Completed"},
+            background=True,
+        )
+        # process_backlog reads its claimed batch back by BatchId on every
+        # scheduler wakeup; sparse, since only claimed docs carry the field.
+        triggers_collection.create_index("BatchId", sparse=True, background=True)
+        # The email lookups ($in batch and per-email fallback) need this to hit
+        # IXSCAN instead of scanning the whole onboarding collection.
+        Enviroment_Collection.create_index("email", background=True)
+    except PyMongoError as e:
+        # A pre-existing index with conflicting options shouldn't stop the agent.
+        log_error("Index Setup", str(e))
+
+def process_backlog():
+    """Catch up on Pending triggers inserted while the agent was down.
+
+    The tail does replay whatever markers are still resident in the capped
+    collection, but markers roll out as it fills, so this sweep is what
+    actually guarantees nothing inserted during the outage is lost.
+
+    The whole backlog is claimed with one tagged update_many and read back with
+    one find on the batch token -- two round-trips regardless of backlog size,
+    and still atomic across agent instances (each instance's BatchId only tags
+    the docs its own update won). The bounded queue throttles how fast we
+    actually dispatch, and the janitor recovers the claims if we die mid-batch."""
+    now = minute_floor_utc()
+    batch_id = ObjectId()
+    result = triggers_collection.update_many(
+        {"Status": "Pending", "ScheduledTimeStamp": {"$lte": now}},
+        {"$set": {"Status": "Running", "worker_id": WORKER_ID, "claimed_at": now, "BatchId": batch_id}},
+    )
+    if not result.modified_count:
+        return
+    for doc in triggers_collection.find({"BatchId": batch_id}, TRIGGER_PROJECTION).batch_size(200):
+        trigger_queue.put(doc)
+
+# === PRODUCER / CONSUMER ===
+# The tail loop runs on its own thread and feeds a bounded queue; several
+# consumer threads drain it, so one trigger's scans no longer hold up the
+# next trigger's credential lookups. Everything is I/O-bound, so the GIL is
+# released during the waits.
+trigger_queue = queue.Queue(maxsize=1000)
+CONSUMER_THREADS = int(os.getenv("CONSUMER_THREADS", "4"))
+FLUSH_INTERVAL_SECONDS = int(os.getenv("FLUSH_INTERVAL_SECONDS", "30"))
+
+def consume_triggers():
+    """Consumer: drain queued triggers in batches and dispatch their scans."""
+    while True:
+        # Drain whatever has accumulated so one $in query can load the
+        # environments for the whole batch instead of one find per trigger.
+        batch = [trigger_queue.get()]
+        try:
+            while True:
+                batch.append(trigger_queue.get_nowait())
+        except queue.Empty:
+            pass
+        by_email = _environments_by_email({t.get("email") for t in batch if t.get("email")})
+        for trigger in batch:
+            try:
+                email = trigger.get("email")
+                if not email:
+                    log_error("Trigger Processing", f"Trigger {trigger.get('_id')} has no email; skipping")
+                    continue
+                dispatch_trigger(trigger, by_email.get(email, []))
+            except Exception as e:
+                log_error("Trigger Processing", str(e))
+            finally:
+                trigger_queue.task_done()
+        # Flush once the queue drains (or the buffer grows large) so a busy
+        # burst still completes in a handful of round-trips. A transient Mongo
+        # error must not kill the consumer thread; the backstop flusher (or the
+        # next pass here) retries the buffered ids.
+        if trigger_queue.empty() or len(_completed_ids) >= COMPLETED_FLUSH_SIZE:
+            try:
+                flush_completed()
+            except PyMongoError as e:
+                log_error("Completion Flush", str(e))
 
-    #client.close()
+def flush_completed_periodically():
+    """Backstop flusher: under a steady trickle the queue may never be empty
+    for a consumer to flush, so sweep the buffer on a timer too."""
+    while True:
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            flush_completed()
+        except PyMongoError as e:
+            log_error("Completion Flush", str(e))
+
+def tail_trigger_events():
+    """Producer: tail the capped trigger_events collection and enqueue Pending triggers."""
+    process_backlog()
+    last_event_id = None
+    while True:
+        try:
+            query = {"_id": {"$gt": last_event_id}} if last_event_id is not None else {}
+            cursor = (
+                trigger_events_collection
+                .find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                .max_await_time_ms(TRIGGER_AWAIT_MS)
+                .batch_size(TRIGGER_BATCH_SIZE)
+            )
+            log_info("Trigger Events", "Tailing capped trigger_events collection")
+            yielded = False
+            while cursor.alive:
+                for event in cursor:
+                    yielded = True
+                    last_event_id = event["_id"]
+                    trigger = triggers_collection.find_one({"_id": event["_id"]}, TRIGGER_PROJECTION)
+                    if trigger and trigger.get("Status") == "Pending":
+                        trigger_queue.put(trigger)  # Blocks when full, which throttles the tail
+            # A tailable cursor on a still-empty capped collection dies
+            # immediately, so pause before reopening or this loop would hammer
+            # find() until the very first marker is written.
+            if not yielded:
+                time.sleep(1)
+        except CursorNotFound:
+            # Capped collection rolled past our position; reopen from the last seen _id.
+            log_info("Trigger Events", "Cursor expired, reopening from last seen event")
+        except PyMongoError as e:
+            log_error("Trigger Events", f"Tail error, reconnecting: {e}")
+            time.sleep(5)
+
+# Guarded so pool worker processes can import this module without starting
+# another agent loop.
+if __name__ == "__main__":
+    try:
+        ensure_trigger_events_collection()
+        ensure_indexes()
+        requeue_interrupted_claims()
+        producer = threading.Thread(target=tail_trigger_events, name="trigger-tail", daemon=True)
+        producer.start()
+        janitor = threading.Thread(target=requeue_stale_claims, name="claim-janitor", daemon=True)
+        janitor.start()
+        flusher = threading.Thread(target=flush_completed_periodically, name="completed-flush", daemon=True)
+        flusher.start()
+        for i in range(CONSUMER_THREADS - 1):
+            threading.Thread(target=consume_triggers, name=f"trigger-consumer-{i}", daemon=True).start()
+        # The main thread is the last consumer so Ctrl-C still lands here.
+        consume_triggers()
+    except KeyboardInterrupt:
+        print("\n⚠️ Stopped by user")
+        log_info("Agent", "Stopped by user")
+    #finally:
+
+        #client.close()
@@ -1,8 +1,16 @@
 import argparse
-import re
+import collections
 import json
+import orjson
+import operator
+import urllib.parse
+import urllib.request
 import datetime
 import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import ClientSecretCredential
 from azure.mgmt.resource import ResourceManagementClient
 from azure.mgmt.costmanagement import CostManagementClient
@@ -14,47 +22,16 @@ from azure.mgmt.containerservice import ContainerServiceClient
 from azure.mgmt.containerregistry import ContainerRegistryManagementClient
 from azure.containerregistry import ContainerRegistryClient
 from azure.identity import DefaultAzureCredential
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 import os
+import functools
 import ipaddress
+import re
 from azure.mgmt.resource.subscriptions import SubscriptionClient
 from kubernetes import client as k8s_client, config as k8s_config
 from datetime import datetime, timedelta
 
 
-# --- Argument Parser for Azure Credentials and MongoDB ---
-parser = argparse.ArgumentParser(description="Azure Resource Optimization Script")
-parser.add_argument("--client_id", required=True, help="Azure Client ID")
-parser.add_argument("--client_secret", required=True, help="Azure Client Secret")
-parser.add_argument("--tenant_id", required=True, help="Azure Tenant ID")
-parser.add_argument("--subscription_id", required=True, help="Azure Subscription ID")
-parser.add_argument("--email", required=True, help="User Email for filtering configs")
-parser.add_argument("--mongo_uri", default="mongodb://localhost:27017/", help="MongoDB connection URI")
-parser.add_argument("--db_name", default="myDB", help="MongoDB database name")
-args = parser.parse_args()
-
-client_id = args.client_id
-client_secret = args.client_secret
-tenant_id = args.tenant_id
-subscription_id = args.subscription_id
-user_email = args.email
-MONGO_URI = args.mongo_uri
-DB_NAME = args.db_name
-
-# print("Client ID:", args.client_id)
-# print("Client Secret:", args.client_secret)
-print("Tenant ID:", args.tenant_id)
-print("Subscription ID:", args.subscription_id)
-print("Email:", args.email)
-
-# --- MongoDB connection details ---
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
-triggers_collection = db["triggers"]
-cost_insights_collection = db["Cost_Insights"]
-environment_onboarding_collection = db["environmentOnboarding"]
-standard_config_collection = db["standardConfigsDb"]
-
 # Define required tag names as a list:
 REQUIRED_TAG_NAMES = [
     "ApplicationCode",
@@ -70,158 +47,269 @@ REQUIRED_TAG_NAMES = [
     "Ticket"
 ]
 
-# Get stor_size and thresholds from standardConfigsDb collection for the current email
-config_thresholds = standard_config_collection.find_one(
-    {"email": user_email},
-    {
-        "cmp_cpu_usage": 1,
-        "cmp_memory_usage": 1,
-        "cmp_network_usage": 1,
-        "stor_size": 1,
-        "subnet_free_ip_threshold": 1,
-        "disk_quota_gb": 1,
-        "k8s_node_count": 1,
-        "k8s_node_cpu_percentage": 1,
-        "k8s_node_memory_percentage": 1,
-        "k8s_volume_percentage": 1,
-        "stor_access_frequency": 1,
-        "db_type": 1,
-        "sql_db_size": 1,
-        "mysql_db_size": 1,
-        "postgres_db_size": 1,
-        "cosmos_db_size": 1,
-        "maria_db_size": 1,
-        "synapse_db_size": 1,
-        "mongo_db_size": 1,
-        "redis_db_size": 1,
-        "_id": 0
-    }
-)
+REQUIRED_TAGS = frozenset(REQUIRED_TAG_NAMES)
+
+def _missing_tags(tags):
+    """Required tags that are absent or empty, in REQUIRED_TAG_NAMES order."""
+    present = {k for k, v in tags.items() if v}
+    if REQUIRED_TAGS <= present:
+        return []
+    missing = REQUIRED_TAGS - present
+    return [tag for tag in REQUIRED_TAG_NAMES if tag in missing]
 
-VM_UNDERUTILIZED_CPU_THRESHOLD = config_thresholds.get("cmp_cpu_usage") if config_thresholds else None
-VM_UNDERUTILIZED_MEMORY_THRESHOLD = config_thresholds.get("cmp_memory_usage") if config_thresholds else None
-VM_UNDERUTILIZED_NETWORK_THRESHOLD = config_thresholds.get("cmp_network_usage") if config_thresholds else None
-#SUBNET_FREE_IP_THRESHOLD = config_thresholds.get("subnet_free_ip_threshold") if config_thresholds else None
-#DISK_QUOTA_GB = int(config_thresholds.get("disk_quota_gb")) if config_thresholds and config_thresholds.get("disk_quota_gb") is not None else None
-sc_stor_size_in_gb = config_thresholds.get("stor_size") if config_thresholds else None
-stor_access_frequency = config_thresholds.get("stor_access_frequency") if config_thresholds else None
-k8s_node_count = config_thresholds.get("k8s_node_count")
-k8s_node_cpu_percentage = config_thresholds.get("k8s_node_cpu_percentage")
-k8s_node_memory_percentage = config_thresholds.get("k8s_node_memory_percentage")
-k8s_volume_percentage = config_thresholds.get("k8s_volume_percentage")
-db_type = config_thresholds.get("db_type") if config_thresholds else None
-sql_db_size_threshold = config_thresholds.get("sql_db_size") if config_thresholds else None
-mysql_db_size_threshold = config_thresholds.get("mysql_db_size") if config_thresholds else None
-postgres_db_size_threshold = config_thresholds.get("postgres_db_size") if config_thresholds else None
-cosmos_db_size_threshold = config_thresholds.get("cosmos_db_size") if config_thresholds else None
-mongo_db_size_threshold = config_thresholds.get("mongo_db_size") if config_thresholds else None
-maria_db_size_threshold = config_thresholds.get("maria_db_size") if config_thresholds else None
-synapse_db_size_threshold = config_thresholds.get("synapse_db_size") if config_thresholds else None
-redis_db_size_threshold = config_thresholds.get("redis_db_size") if config_thresholds else None
 DISK_QUOTA_GB = 100
 SUBNET_FREE_IP_THRESHOLD = 100
 IMAGE_SIZE_THRESHOLD_MB = 100
 
+# Oversized base image -> (minimal alternative, its size in MB).
+MINIMAL_IMAGE_MAP = {
+    "ubuntu": ("ubuntu:minimal", 29),
+    "debian": ("debian:slim", 22),
+    "python": ("python:slim", 40),
+    "node": ("node:alpine", 5),
+    "golang": ("golang:alpine", 5),
+    "nginx": ("nginx:alpine", 5),
+    "httpd": ("httpd:alpine", 5),
+    "openjdk": ("openjdk:alpine", 10),
+    "mysql": ("mysql:8.0-slim", 40),
+    "redis": ("redis:alpine", 5),
+    "busybox": ("busybox", 1),
+    "scratch": ("scratch", 0),
+    "distroless/base": ("gcr.io/distroless/base", 20)
+}
+# One C-level alternation scan rejects repos that match no base image.
+_BASE_IMAGE_RE = re.compile(
+    "|".join(re.escape(k) for k in sorted(MINIMAL_IMAGE_MAP, key=len, reverse=True))
+)
 
-try:
-    client.admin.command('ismaster')
-    print(f"MongoDB connection to {MONGO_URI} established successfully.")
-except Exception as e:
-    print(f"MongoDB connection failed: {e}")
-
-def normalize_resource_id(resource_id):
-    clean_id = re.sub(r'[\u200b\xa0\s]+', '', resource_id)
-    return clean_id.strip().rstrip('/').lower()
+# Lowercased type prefix (first two/three segments) -> (ResourceType,
+# SubResourceType). One dict lookup replaces the O(12) startswith chain that
+# ran for every resource in the subscription.
+TYPE_DISPATCH = {
+    "microsoft.sql/servers/databases": ("Database", "Sql"),
+    "microsoft.dbformysql/servers/databases": ("Database", "MySQL"),
+    "microsoft.dbforpostgresql/servers/databases": ("Database", "PostgreSQL"),
+    "microsoft.dbformariadb/servers/databases": ("Database", "MariaDB"),
+    "microsoft.documentdb/databaseaccounts": ("Database", "CosmosDB"),
+    "microsoft.dbformongodb/servers/databases": ("Database", "MongoDB"),
+    "microsoft.synapse/workspaces": ("Database", "Synapse"),
+    "microsoft.cache/redis": ("Database", "Redis"),
+    "microsoft.storage/storageaccounts": ("Storage", "Bucket"),
+}
+# Exact-type matches that must not swallow their child types.
+TYPE_EXACT_DISPATCH = {
+    "microsoft.sql/servers": ("Sql", "Server"),
+}
+
+# Credential/identity/Mongo globals are populated by _configure() below, either
+# from run() (in-process invocation from Agent.py) or from the CLI shim.
+client_id = None
+client_secret = None
+tenant_id = None
+subscription_id = None
+user_email = None
+MONGO_URI = "mongodb://localhost:27017/"
+DB_NAME = "myDB"
+
+# Reuse ClientSecretCredential instances across runs so the cached AAD token
+# survives between triggers instead of re-authing every time.
+_credential_cache = {}
+
+# Thresholds change rarely, so repeat in-process runs within the TTL skip the
+# standardConfigsDb round-trip.
+THRESHOLDS_CACHE_TTL_SECONDS = 60
+_thresholds_cache = {}
+
+BULK_WRITE_BATCH_SIZE = 1000
+
+THRESHOLDS_PROJECTION = {
+    "cmp_cpu_usage": 1,
+    "cmp_memory_usage": 1,
+    "cmp_network_usage": 1,
+    "stor_size": 1,
+    "subnet_free_ip_threshold": 1,
+    "disk_quota_gb": 1,
+    "k8s_node_count": 1,
+    "k8s_node_cpu_percentage": 1,
+    "k8s_node_memory_percentage": 1,
+    "k8s_volume_percentage": 1,
+    "stor_access_frequency": 1,
+    "db_type": 1,
+    "sql_db_size": 1,
+    "mysql_db_size": 1,
+    "postgres_db_size": 1,
+    "cosmos_db_size": 1,
+    "maria_db_size": 1,
+    "synapse_db_size": 1,
+    "mongo_db_size": 1,
+    "redis_db_size": 1,
+    "_id": 0,
+}
+
+def load_thresholds(email):
+    """Fetch the user's thresholds from standardConfigsDb, memoized with a TTL."""
+    now = time.monotonic()
+    entry = _thresholds_cache.get(email)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    thresholds = standard_config_collection.find_one({"email": email}, THRESHOLDS_PROJECTION)
+    _thresholds_cache[email] = (now + THRESHOLDS_CACHE_TTL_SECONDS, thresholds)
+    return thresholds
+
+def get_credential(tenant, client, secret):
+    key = (tenant, client)
+    credential = _credential_cache.get(key)
+    if credential is None:
+        credential = ClientSecretCredential(tenant, client, secret)
+        _credential_cache[key] = credential
+    return credential
+
+def _configure(cid, csecret, tid, sid, email, mongo_uri, db_name):
+    """Bind credentials/identity globals and (re)connect MongoDB + thresholds."""
+    global client_id, client_secret, tenant_id, subscription_id, user_email, MONGO_URI, DB_NAME
+    global client, db, triggers_collection, cost_insights_collection
+    global environment_onboarding_collection, standard_config_collection
+    global config_thresholds
+    global VM_UNDERUTILIZED_CPU_THRESHOLD, VM_UNDERUTILIZED_MEMORY_THRESHOLD, VM_UNDERUTILIZED_NETWORK_THRESHOLD
+    global sc_stor_size_in_gb, stor_access_frequency
+    global k8s_node_count, k8s_node_cpu_percentage, k8s_node_memory_percentage, k8s_volume_percentage
+    global db_type, sql_db_size_threshold, mysql_db_size_threshold, postgres_db_size_threshold
+    global cosmos_db_size_threshold, mongo_db_size_threshold, maria_db_size_threshold
+    global synapse_db_size_threshold, redis_db_size_threshold
+
+    client_id = cid
+    client_secret = csecret
+    tenant_id = tid
+    subscription_id = sid
+    user_email = email
+    MONGO_URI = mongo_uri
+    DB_NAME = db_name
+
+    print("Tenant ID:", tenant_id)
+    print("Subscription ID:", subscription_id)
+    print("Email:", user_email)
+
+    # --- MongoDB connection details ---
+    client = MongoClient(MONGO_URI)
+    db = client[DB_NAME]
+    triggers_collection = db["triggers"]
+    cost_insights_collection = db["Cost_Insights"]
+    environment_onboarding_collection = db["environmentOnboarding"]
+    standard_config_collection = db["standardConfigsDb"]
+
+    # Get stor_size and thresholds from standardConfigsDb collection for the current email
+    config_thresholds = load_thresholds(user_email)
+
+    VM_UNDERUTILIZED_CPU_THRESHOLD = config_thresholds.get("cmp_cpu_usage") if config_thresholds else None
+    VM_UNDERUTILIZED_MEMORY_THRESHOLD = config_thresholds.get("cmp_memory_usage") if config_thresholds else None
+    VM_UNDERUTILIZED_NETWORK_THRESHOLD = config_thresholds.get("cmp_network_usage") if config_thresholds else None
+    #SUBNET_FREE_IP_THRESHOLD = config_thresholds.get("subnet_free_ip_threshold") if config_thresholds else None
+    #DISK_QUOTA_GB = int(config_thresholds.get("disk_quota_gb")) if config_thresholds and config_thresholds.get("disk_quota_gb") is not None else None
+    sc_stor_size_in_gb = config_thresholds.get("stor_size") if config_thresholds else None
+    stor_access_frequency = config_thresholds.get("stor_access_frequency") if config_thresholds else None
+    k8s_node_count = config_thresholds.get("k8s_node_count") if config_thresholds else None
+    k8s_node_cpu_percentage = config_thresholds.get("k8s_node_cpu_percentage") if config_thresholds else None
+    k8s_node_memory_percentage = config_thresholds.get("k8s_node_memory_percentage") if config_thresholds else None
+    k8s_volume_percentage = config_thresholds.get("k8s_volume_percentage") if config_thresholds else None
+    db_type = config_thresholds.get("db_type") if config_thresholds else None
+    sql_db_size_threshold = config_thresholds.get("sql_db_size") if config_thresholds else None
+    mysql_db_size_threshold = config_thresholds.get("mysql_db_size") if config_thresholds else None
+    postgres_db_size_threshold = config_thresholds.get("postgres_db_size") if config_thresholds else None
+    cosmos_db_size_threshold = config_thresholds.get("cosmos_db_size") if config_thresholds else None
+    mongo_db_size_threshold = config_thresholds.get("mongo_db_size") if config_thresholds else None
+    maria_db_size_threshold = config_thresholds.get("maria_db_size") if config_thresholds else None
+    synapse_db_size_threshold = config_thresholds.get("synapse_db_size") if config_thresholds else None
+    redis_db_size_threshold = config_thresholds.get("redis_db_size") if config_thresholds else None
 
-def get_storage_account_size(storage_client, resource_group_name, storage_account_name):
-    """Get the total used capacity of a storage account in GB."""
     try:
-        return 0.5  # Placeholder - change this to test filtering logic (0.5 GB < 1 GB threshold)
-        
+        client.admin.command('ismaster')
+        print(f"MongoDB connection to {MONGO_URI} established successfully.")
     except Exception as e:
-        print(f"Error getting storage account size for {storage_account_name}: {e}")
-        return None
+        print(f"MongoDB connection failed: {e}")
+
+def _coerce_cost(value):
+    """Parse a cost value into a rounded float, defaulting to 0 for junk.
 
-def get_vm_average_cpu(monitor_client, resource_id, start_time, end_time):
-    """Fetch average CPU utilization for a VM over a period."""
+    float() handles negatives and scientific notation that the old
+    str.isdigit() probe rejected.
+    """
     try:
-        metrics_data = monitor_client.metrics.list(
-            resource_id,
-            timespan=f"{start_time}/{end_time}",
-            interval='PT1H',
-            metricnames='Percentage CPU',
-            aggregation='Average'
-        )
-        values = []
-        for item in metrics_data.value:
-            for timeserie in item.timeseries:
-                for data in timeserie.data:
-                    if data.average is not None:
-                        values.append(data.average)
-        if values:
-            return sum(values) / len(values)
-        return None
-    except Exception as e:
-        print(f"Error fetching CPU metrics for {resource_id}: {e}")
-        return None
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return 0
 
-def get_vm_average_memory(monitor_client, resource_id, start_time, end_time):
-    """Fetch average memory utilization for a VM over a period."""
+# Zero-width spaces, NBSPs and whitespace that creep into resource ids.
+_ID_STRIP_TABLE = str.maketrans('', '', '\u200b\xa0 \t\n\r\v\f')
+
+def normalize_resource_id(resource_id):
+    return resource_id.translate(_ID_STRIP_TABLE).rstrip('/').lower()
+
+def get_storage_account_size(monitor_client, resource_id, storage_account_name):
+    """Get the total used capacity of a storage account in GB via Monitor's UsedCapacity."""
     try:
-        metrics_data = monitor_client.metrics.list(
-            resource_id,
-            timespan=f"{start_time}/{end_time}",
-            interval='PT1H',
-            metricnames='Available Memory Bytes',
-            aggregation='Average'
+        end_time = datetime.utcnow()
+        start_time = end_time - timedelta(hours=2)
+        metrics = fetch_resource_metrics(
+            monitor_client, resource_id, 'UsedCapacity',
+            start_time.isoformat() + "Z", end_time.isoformat() + "Z"
         )
-        values = []
-        for item in metrics_data.value:
-            for timeserie in item.timeseries:
-                for data in timeserie.data:
-                    if data.average is not None:
-                        values.append(data.average)
-        if values:
-            # Convert bytes to percent if total memory is known, else just return average bytes
-            return sum(values) / len(values)
-        return None
+        used_bytes = metrics.get('UsedCapacity')
+        return used_bytes / 1e9 if used_bytes is not None else None
     except Exception as e:
-        print(f"Error fetching Memory metrics for {resource_id}: {e}")
+        print(f"Error getting storage account size for {storage_account_name}: {e}")
         return None
 
-def get_vm_average_network(monitor_client, resource_id, start_time, end_time):
-    """Fetch average network utilization for a VM over a period."""
+VM_METRIC_NAMES = 'Percentage CPU,Available Memory Bytes,Network In Total'
+
+def fetch_resource_metrics(monitor_client, resource_id, metricnames, start_time, end_time):
+    """Fetch several metrics for one resource in a single Monitor call.
+
+    metrics.list accepts a comma-separated metric list, so the old
+    one-round-trip-per-metric helpers (CPU, memory, network) collapse into a
+    single HTTP call per resource. Returns {metric_name: average}; metrics
+    with no data points are absent from the dict.
+    """
+    averages = {}
     try:
         metrics_data = monitor_client.metrics.list(
             resource_id,
             timespan=f"{start_time}/{end_time}",
             interval='PT1H',
-            metricnames='Network In Total',
+            metricnames=metricnames,
             aggregation='Average'
         )
-        values = []
         for item in metrics_data.value:
+            # Single-pass mean: no intermediate list per metric.
+            total = 0.0
+            count = 0
             for timeserie in item.timeseries:
                 for data in timeserie.data:
                     if data.average is not None:
-                        values.append(data.average)
-        if values:
-            return sum(values) / len(values)
-        return None
+                        total += data.average
+                        count += 1
+            if count:
+                averages[item.name.value] = total / count
     except Exception as e:
-        print(f"Error fetching Network metrics for {resource_id}: {e}")
-        return None
+        print(f"Error fetching metrics '{metricnames}' for {resource_id}: {e}")
+    return averages
+
+@functools.lru_cache(maxsize=1024)
+def _num_addresses(prefix):
+    """Address count for a CIDR prefix; many subnets share the same prefix length."""
+    return ipaddress.ip_network(prefix).num_addresses
+
+def _subnet_free_ip_percent(subnet):
+    """Percent of free IPs in an already-fetched subnet object."""
+    total_ips = _num_addresses(subnet.address_prefix) - 5  # Azure reserves 5 IPs per subnet
+    used_ips = subnet.ip_configurations and len(subnet.ip_configurations) or 0
+    free_ips = total_ips - used_ips
+    return (free_ips / total_ips) * 100 if total_ips > 0 else 0
 
 def get_subnet_free_ip_percent(network_client, resource_group, vnet_name, subnet_name):
     """Returns the percent of free IPs in the subnet."""
     try:
         subnet = network_client.subnets.get(resource_group, vnet_name, subnet_name)
-        prefix = subnet.address_prefix
-        total_ips = ipaddress.ip_network(prefix).num_addresses - 5  # Azure reserves 5 IPs per subnet
-        used_ips = subnet.ip_configurations and len(subnet.ip_configurations) or 0
-        free_ips = total_ips - used_ips
-        free_percent = (free_ips / total_ips) * 100 if total_ips > 0 else 0
-        return free_percent
+        return _subnet_free_ip_percent(subnet)
     except Exception as e:
         print(f"Error fetching subnet info for {subnet_name}: {e}")
         return None
@@ -230,17 +318,76 @@ def get_aks_node_metrics(monitor_client, vm_resource_ids, start_time, end_time):
     """Aggregate average CPU and memory usage for AKS nodes."""
     cpu_values = []
     memory_values = []
-    for vm_id in vm_resource_ids:
-        cpu = get_vm_average_cpu(monitor_client, vm_id, start_time, end_time)
-        mem = get_vm_average_memory(monitor_client, vm_id, start_time, end_time)
-        if cpu is not None:
-            cpu_values.append(cpu)
-        if mem is not None:
-            memory_values.append(mem)
+    if not vm_resource_ids:
+        return None, None
+
+    def fetch(vm_id):
+        return fetch_resource_metrics(
+            monitor_client, vm_id, 'Percentage CPU,Available Memory Bytes', start_time, end_time
+        )
+
+    # One Monitor call per node, but overlapped: a 50-node cluster no longer
+    # pays for 50 sequential round trips.
+    with ThreadPoolExecutor(max_workers=min(16, len(vm_resource_ids))) as pool:
+        for metrics in pool.map(fetch, vm_resource_ids):
+            cpu = metrics.get('Percentage CPU')
+            mem = metrics.get('Available Memory Bytes')
+            if cpu is not None:
+                cpu_values.append(cpu)
+            if mem is not None:
+                memory_values.append(mem)
     avg_cpu = sum(cpu_values) / len(cpu_values) if cpu_values else None
     avg_mem = sum(memory_values) / len(memory_values) if memory_values else None
     return avg_cpu, avg_mem
 
+def get_aks_node_metrics_batch(credential, vm_resource_ids, start_time, end_time):
+    """Per-VM average CPU/memory via the ARM /batch endpoint.
+
+    One POST covers 20 node VMs instead of one Monitor call per node.
+    Returns {vm_id: (avg_cpu, avg_memory)}.
+    """
+    if not vm_resource_ids:
+        return {}
+    metric_qs = urllib.parse.urlencode({
+        "api-version": "2018-01-01",
+        "metricnames": "Percentage CPU,Available Memory Bytes",
+        "timespan": f"{start_time}/{end_time}",
+        "aggregation": "Average",
+    })
+    urls = [f"{vm_id}/providers/microsoft.insights/metrics?{metric_qs}" for vm_id in vm_resource_ids]
+    payloads = _batch_get(credential, urls)
+    results = {}
+    for vm_id, payload in zip(vm_resource_ids, payloads):
+        avg_cpu = avg_mem = None
+        for metric in payload.get("value", []):
+            total = 0.0
+            count = 0
+            for series in metric.get("timeseries", []):
+                for point in series.get("data", []):
+                    average = point.get("average")
+                    if average is not None:
+                        total += average
+                        count += 1
+            value = total / count if count else None
+            metric_name = metric.get("name", {}).get("value")
+            if metric_name == "Percentage CPU":
+                avg_cpu = value
+            elif metric_name == "Available Memory Bytes":
+                avg_mem = value
+        results[vm_id] = (avg_cpu, avg_mem)
+    return results
+
+# Kubernetes quantity suffix -> factor; '' is the bare-number fallback.
+_CPU_MILLICORES = {'n': 1e-6, 'u': 1e-3, 'm': 1.0, '': 1000.0}
+_MEM_MIB = {'Ki': 1 / 1024, 'Mi': 1.0, 'Gi': 1024.0, '': 1 / (1024 * 1024)}
+
+def _parse_quantity(value, factors):
+    """Convert a Kubernetes quantity string via a suffix lookup table."""
+    i = len(value)
+    while i and not value[i - 1].isdigit():
+        i -= 1
+    return float(value[:i]) * factors.get(value[i:], factors[''])
+
 def get_k8s_api_node_metrics():
     try:
         # Try in-cluster config, fallback to kubeconfig
@@ -255,28 +402,9 @@ def get_k8s_api_node_metrics():
         cpu_values = []
         memory_values = []
         for item in metrics['items']:
-            cpu = item['usage']['cpu']
-            mem = item['usage']['memory']
-            # Convert cpu (e.g., "50m" or "1") to millicores
-            if cpu.endswith('n'):
-                cpu_val = float(cpu[:-1]) / 1e6
-            elif cpu.endswith('u'):
-                cpu_val = float(cpu[:-1]) / 1e3
-            elif cpu.endswith('m'):
-                cpu_val = float(cpu[:-1])
-            else:
-                cpu_val = float(cpu) * 1000
-            # Convert memory (e.g., "128974848Ki") to MiB
-            if mem.endswith('Ki'):
-                mem_val = float(mem[:-2]) / 1024
-            elif mem.endswith('Mi'):
-                mem_val = float(mem[:-2])
-            elif mem.endswith('Gi'):
-                mem_val = float(mem[:-2]) * 1024
-            else:
-                mem_val = float(mem) / (1024 * 1024)
-            cpu_values.append(cpu_val)
-            memory_values.append(mem_val)
+            # cpu (e.g. "50m" or "1") to millicores, memory (e.g. "128974848Ki") to MiB
+            cpu_values.append(_parse_quantity(item['usage']['cpu'], _CPU_MILLICORES))
+            memory_values.append(_parse_quantity(item['usage']['memory'], _MEM_MIB))
         avg_cpu = sum(cpu_values) / len(cpu_values) if cpu_values else None
         avg_mem = sum(memory_values) / len(memory_values) if memory_values else None
         return avg_cpu, avg_mem
@@ -284,23 +412,137 @@ def get_k8s_api_node_metrics():
         print(f"[WARNING] Could not fetch node metrics from Kubernetes API: {e}")
         return None, None
 
-def analyze_azure_resources():
+def _merge_cost_rows(resource_cost_map, columns, rows):
+    """Fold one page of cost rows into the map as it arrives."""
+    if not rows:
+        return
+    names = [col.name if hasattr(col, "name") else col["name"] for col in columns]
+    pick = operator.itemgetter(names.index("ResourceId"), names.index("PreTaxCost"))
+    # dict.update with a generator keeps the per-row work inside the C loop.
+    resource_cost_map.update(
+        (normalize_resource_id(rid), cost) for rid, cost in map(pick, rows)
+    )
+
+def _fetch_cost_page(credential, next_link, rest_body):
+    """POST the query to a Cost Management nextLink URL and return the raw page."""
+    token = credential.get_token("https://management.azure.com/.default").token
+    request = urllib.request.Request(
+        next_link,
+        data=json.dumps(rest_body).encode(),
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.load(response)["properties"]
+
+# DefaultAzureCredential chains env/IMDS/CLI probes on construction; build it
+# once and let its token cache amortize across every registry.
+@functools.lru_cache(maxsize=None)
+def _default_credential():
+    return DefaultAzureCredential()
+
+@functools.lru_cache(maxsize=None)
+def _get_acr_client(endpoint):
+    return ContainerRegistryClient(endpoint, _default_credential())
+
+_NA = "na"
+
+def _tag_lower(tags, key):
+    """tags.get(key, "na") lowercased, without allocating for the default."""
+    value = tags.get(key)
+    return value.lower() if value is not None else _NA
+
+def _format_orphan(obj, sub_resource_type, scan_timestamp, resource_type="Network", **overrides):
+    """Common document shape shared by every orphaned-resource finding."""
+    tags = obj.tags if getattr(obj, "tags", None) else {}
+    doc = {
+        "_id": str(obj.id),
+        "CloudProvider": tags.get("CloudProvider", "Azure"),
+        "ManagementUnitId": subscription_id,
+        "ApplicationCode": _tag_lower(tags, "ApplicationCode"),
+        "CostCenter": _tag_lower(tags, "CostCenter"),
+        "CIO": _tag_lower(tags, "CIO"),
+        "Platform": _tag_lower(tags, "Platform"),
+        "Lab": _tag_lower(tags, "Lab"),
+        "Feature": _tag_lower(tags, "Feature"),
+        "Owner": _tag_lower(tags, "Owner"),
+        "TicketId": _tag_lower(tags, "Ticket"),
+        "ResourceType": resource_type,
+        "SubResourceType": sub_resource_type,
+        "ResourceName": obj.name,
+        "Region": obj.location,
+        "TotalCost": 0,
+        "Currency": "USD",
+        "Finding": "OrphandResource",
+        "Recommendation": "Delete",
+        "Environment": _tag_lower(tags, "Environment"),
+        "Timestamp": scan_timestamp,
+        "ConfidenceScore": tags.get("ConfidenceScore", "na"),
+        "Status": "available",
+        "Entity": _tag_lower(tags, "Entity"),
+        "RootId": tenant_id,
+        "Email": user_email,
+        "Size": ""
+    }
+    doc.update(overrides)
+    return doc
+
+ARM_BATCH_URL = "https://management.azure.com/batch?api-version=2020-06-01"
+ARM_BATCH_SIZE = 20
+
+def _batch_get(credential, urls):
+    """Multiplex ARM GETs through the /batch endpoint, 20 per POST.
+
+    One POST decrements the tenant rate limit once instead of once per GET.
+    Returns the response content dicts in the same order as urls; a failed
+    entry comes back as an empty dict.
+    """
+    results = []
+    token = credential.get_token("https://management.azure.com/.default").token
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    for i in range(0, len(urls), ARM_BATCH_SIZE):
+        payload = {"requests": [{"httpMethod": "GET", "url": u} for u in urls[i:i + ARM_BATCH_SIZE]]}
+        request = urllib.request.Request(
+            ARM_BATCH_URL, data=json.dumps(payload).encode(), headers=headers, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=60) as response:
+            body = json.load(response)
+        for item in body.get("responses", []):
+            results.append(item.get("content") or {})
+    return results
+
+def _scan_findings():
+    """Run the subscription scan, yielding findings as they are produced.
+
+    Generator form keeps memory at one in-flight finding; the consumer
+    decides how to accumulate or persist them.
+    """
     print("[INFO] Starting Azure resource optimization analysis...")
 
-    # Use credentials from argparse
-    credential = ClientSecretCredential(tenant_id, client_id, client_secret)
-    resource_client = ResourceManagementClient(credential, subscription_id)
-    cost_client = CostManagementClient(credential)
-    storage_client = StorageManagementClient(credential, subscription_id)
-    monitor_client = MonitorManagementClient(credential, subscription_id)
-    compute_client = ComputeManagementClient(credential, subscription_id)
-    network_client = NetworkManagementClient(credential, subscription_id)
-    aks_client = ContainerServiceClient(credential, subscription_id)
-    container_registry_client = ContainerRegistryManagementClient(credential, subscription_id)
-    subscription_client = SubscriptionClient(credential)
+    # Use the cached credential so the AAD token is reused across runs
+    credential = get_credential(tenant_id, client_id, client_secret)
+    # One pooled HTTP session for all management clients: without it each
+    # client opens its own connections, which starves TCP/TLS reuse once the
+    # per-resource thread pool is running.
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=64, pool_maxsize=64))
+    transport = RequestsTransport(session=session, connection_timeout=10, read_timeout=60)
+    resource_client = ResourceManagementClient(credential, subscription_id, transport=transport)
+    cost_client = CostManagementClient(credential, transport=transport)
+    storage_client = StorageManagementClient(credential, subscription_id, transport=transport)
+    monitor_client = MonitorManagementClient(credential, subscription_id, transport=transport)
+    compute_client = ComputeManagementClient(credential, subscription_id, transport=transport)
+    network_client = NetworkManagementClient(credential, subscription_id, transport=transport)
+    aks_client = ContainerServiceClient(credential, subscription_id, transport=transport)
+    container_registry_client = ContainerRegistryManagementClient(credential, subscription_id, transport=transport)
+    subscription_client = SubscriptionClient(credential, transport=transport)
 
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=7)
+    # Formatted once; reused by every per-resource metrics call and document.
+    start_iso = start_date.isoformat() + "Z"
+    end_iso = end_date.isoformat() + "Z"
+    scan_timestamp = end_iso
 
     # Cost query setup
     cost_query = {
@@ -327,62 +569,70 @@ def analyze_azure_resources():
         }
     }
 
-    # Get cost data
+    # Wire-format copy of the query; nextLink pages are fetched over raw REST
+    # and the POST body must use camelCase keys.
+    rest_cost_query = {
+        "type": "Usage",
+        "timeframe": "Custom",
+        "timePeriod": cost_query["time_period"],
+        "dataset": cost_query["dataset"],
+    }
+
+    # Get cost data, folding each page into the map as it arrives instead of
+    # materializing all rows first. Subscriptions past the server page size
+    # come back with a nextLink.
+    resource_cost_map = {}
     cost_data = cost_client.query.usage(
         scope=f"/subscriptions/{subscription_id}",
         parameters=cost_query
     )
-
-    # Build resource ID -> cost map
-    resource_cost_map = {}
-    if cost_data and cost_data.rows:
-        columns = [col.name for col in cost_data.columns]
-        rid_idx = columns.index("ResourceId")
-        cost_idx = columns.index("PreTaxCost")
-        for row in cost_data.rows:
-            rid = normalize_resource_id(row[rid_idx])
-            cost_val = row[cost_idx]
-            resource_cost_map[rid] = cost_val
+    if cost_data:
+        _merge_cost_rows(resource_cost_map, cost_data.columns, cost_data.rows)
+        next_link = getattr(cost_data, "next_link", None)
+        while next_link:
+            try:
+                page = _fetch_cost_page(credential, next_link, rest_cost_query)
+            except Exception as e:
+                print(f"[WARNING] Failed to fetch next cost page, continuing with partial cost data: {e}")
+                break
+            _merge_cost_rows(resource_cost_map, page.get("columns", []), page.get("rows", []))
+            next_link = page.get("nextLink")
 
     matched_count = 0
     unmatched_count = 0
-    underutilized_resources = []
 
-    # Main resource loop
-    for resource in resource_client.resources.list():
+    # One disks.list() page-through up front instead of a disks.get round-trip
+    # per managed disk inside the loop; the orphaned-disk pass reuses this too.
+    disks_by_id = {normalize_resource_id(d.id): d for d in compute_client.disks.list()}
+
+    db_threshold_by_subtype = {
+        "Sql": sql_db_size_threshold,
+        "MySQL": mysql_db_size_threshold,
+        "PostgreSQL": postgres_db_size_threshold,
+        "MariaDB": maria_db_size_threshold,
+        "CosmosDB": cosmos_db_size_threshold,
+        "MongoDB": mongo_db_size_threshold,
+        "Synapse": synapse_db_size_threshold,
+        "Redis": redis_db_size_threshold,
+    }
+
+    # Loop body for one resource. Returns (formatted_resource or None, matched)
+    # so the caller can run it across a thread pool and keep the counters and
+    # result list single-threaded.
+    def process_resource(resource):
         tags = resource.tags or {}
         type_parts = resource.type.split("/") if resource.type else ["Unknown", "Unknown"]
-        # Correct SubResourceType logic
-        if resource.type.startswith("Microsoft.Sql/servers/databases"):
-            resource_type_value = "Database"
-            sub_resource_type = "Sql"
-        elif resource.type.startswith("Microsoft.DBforMySQL/servers/databases"):
-            resource_type_value = "Database"
-            sub_resource_type = "MySQL"
-        elif resource.type.startswith("Microsoft.DBforPostgreSQL/servers/databases"):
-            resource_type_value = "Database"
-            sub_resource_type = "PostgreSQL"
-        elif resource.type.startswith("Microsoft.DBforMariaDB/servers/databases"):
-            resource_type_value = "Database"
-            sub_resource_type = "MariaDB"
-        elif resource.type.startswith("Microsoft.DocumentDB/databaseAccounts"):
-            resource_type_value = "Database"
-            sub_resource_type = "CosmosDB"
-        elif resource.type.startswith("Microsoft.DBforMongoDB/servers/databases"):
-            resource_type_value = "Database"
-            sub_resource_type = "MongoDB"
-        elif resource.type.startswith("Microsoft.Synapse/workspaces"):
-            resource_type_value = "Database"
-            sub_resource_type = "Synapse"
-        elif resource.type.startswith("Microsoft.Cache/Redis"):
-            resource_type_value = "Database"
-            sub_resource_type = "Redis"
-        elif resource.type == "Microsoft.Sql/servers":
-            resource_type_value = "Sql"
-            sub_resource_type = "Server"
-        elif resource.type and "Microsoft.Storage/storageAccounts" in resource.type:
-            resource_type_value = "Storage"
-            sub_resource_type = "Bucket"
+        id_parts = resource.id.split('/')
+        # Classification via the precompiled dispatch tables
+        rtype = resource.type.lower() if resource.type else ""
+        type_segments = rtype.split("/")
+        dispatch = (
+            TYPE_EXACT_DISPATCH.get(rtype)
+            or TYPE_DISPATCH.get("/".join(type_segments[:3]))
+            or TYPE_DISPATCH.get("/".join(type_segments[:2]))
+        )
+        if dispatch:
+            resource_type_value, sub_resource_type = dispatch
         elif len(type_parts) > 1:
             resource_type_value = type_parts[0].replace("Microsoft.", "").capitalize()
             sub_resource_type = type_parts[1][0].upper() + type_parts[1][1:]
@@ -392,49 +642,51 @@ def analyze_azure_resources():
         normalized_id = normalize_resource_id(resource.id)
         total_cost = resource_cost_map.get(normalized_id, "Unknown")
 
-        if total_cost == "Unknown":
-            unmatched_count += 1
-        else:
-            matched_count += 1
+        matched = total_cost != "Unknown"
 
-        finding_value = "Bucket Underutilised" if resource.type and "Microsoft.Storage/storageAccounts" in resource.type else tags.get("Finding", "auto-generated from cost explorer").lower()
-        recommendation_value = "Try Merging" if resource.type and "Microsoft.Storage/storageAccounts" in resource.type else tags.get("Recommendation", "review usage").lower()
+        is_storage_account = dispatch == ("Storage", "Bucket")
+        finding_value = "Bucket Underutilised" if is_storage_account else tags.get("Finding", "auto-generated from cost explorer").lower()
+        recommendation_value = "Try Merging" if is_storage_account else tags.get("Recommendation", "review usage").lower()
 
-        formatted_resource = {
-            "_id": str(resource.id),
-            "CloudProvider": tags.get("CloudProvider", "Azure"),
-            "ManagementUnitId": subscription_id,
-            "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-            "CostCenter": tags.get("CostCenter", "na").lower(),
-            "CIO": tags.get("CIO", "na").lower(),
-            "Platform": tags.get("Platform", "na").lower(),
-            "Lab": tags.get("Lab", "na").lower(),
-            "Feature": tags.get("Feature", "na").lower(),
-            "Owner": tags.get("Owner", "na").lower(),
-            "TicketId": tags.get("Ticket", "na").lower(),
-            "ResourceType": resource_type_value.capitalize(),
-            "SubResourceType": sub_resource_type,
-            "ResourceName": resource.name,
-            "Region": resource.location if resource.location else "na",
-            "TotalCost": round(float(total_cost), 2) if isinstance(total_cost, (int, float, str)) and str(total_cost).replace('.', '', 1).isdigit() else 0,
-            "Currency": tags.get("Currency", "usd").upper(),
-            "Finding": finding_value,
-            "Recommendation": recommendation_value,
-            "Environment": tags.get("Environment", "na").lower(),
-            "Timestamp": datetime.utcnow().isoformat() + "Z",
-            "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-            "Status": tags.get("Status", "available").lower(),
-            "Entity": tags.get("Entity", "na").lower(),
-            "RootId": tenant_id,
-            "Email": user_email
-        }
+        def make_formatted():
+            # Built lazily: most resources produce no finding, so the ~20
+            # tag-derived string operations only run for emitted documents.
+            return {
+                "_id": str(resource.id),
+                "CloudProvider": tags.get("CloudProvider", "Azure"),
+                "ManagementUnitId": subscription_id,
+                "ApplicationCode": _tag_lower(tags, "ApplicationCode"),
+                "CostCenter": _tag_lower(tags, "CostCenter"),
+                "CIO": _tag_lower(tags, "CIO"),
+                "Platform": _tag_lower(tags, "Platform"),
+                "Lab": _tag_lower(tags, "Lab"),
+                "Feature": _tag_lower(tags, "Feature"),
+                "Owner": _tag_lower(tags, "Owner"),
+                "TicketId": _tag_lower(tags, "Ticket"),
+                "ResourceType": resource_type_value.capitalize(),
+                "SubResourceType": sub_resource_type,
+                "ResourceName": resource.name,
+                "Region": resource.location if resource.location else "na",
+                "TotalCost": _coerce_cost(total_cost),
+                "Currency": tags.get("Currency", "usd").upper(),
+                "Finding": finding_value,
+                "Recommendation": recommendation_value,
+                "Environment": _tag_lower(tags, "Environment"),
+                "Timestamp": scan_timestamp,
+                "ConfidenceScore": tags.get("ConfidenceScore", "na"),
+                "Status": tags.get("Status", "available").lower(),
+                "Entity": _tag_lower(tags, "Entity"),
+                "RootId": tenant_id,
+                "Email": user_email
+            }
 
         # Storage account underutilized logic
-        if resource.type and "Microsoft.Storage/storageAccounts" in resource.type:
-            resource_group_name = resource.id.split('/')[4] if len(resource.id.split('/')) > 4 else None
+        if is_storage_account:
+            resource_group_name = id_parts[4] if len(id_parts) > 4 else None
             if resource_group_name:
-                stor_size_gb = get_storage_account_size(storage_client, resource_group_name, resource.name)
+                stor_size_gb = get_storage_account_size(monitor_client, resource.id, resource.name)
                 if stor_size_gb is not None and sc_stor_size_in_gb is not None and stor_size_gb < sc_stor_size_in_gb:
+                    formatted_resource = make_formatted()
                     formatted_resource["Current_Size"] = stor_size_gb
                     # Recommendation logic based on stor_access_frequency
                     if stor_access_frequency == "Hot":
@@ -442,28 +694,33 @@ def analyze_azure_resources():
                     elif stor_access_frequency == "Cold":
                         formatted_resource["Recommendation"] = "Try Merging"
                     print(f"[UNDERUTILIZED] Storage Account: {resource.name} - Size: {stor_size_gb}GB")
-                    underutilized_resources.append(formatted_resource)
-            continue
+                    return formatted_resource, matched
+            return None, matched
 
         # VM underutilized logic
         if resource.type and "Microsoft.Compute/virtualMachines" in resource.type:
-            avg_cpu = get_vm_average_cpu(monitor_client, resource.id, start_date.isoformat() + "Z", end_date.isoformat() + "Z")
-            avg_memory = get_vm_average_memory(monitor_client, resource.id, start_date.isoformat() + "Z", end_date.isoformat() + "Z")
-            avg_network = get_vm_average_network(monitor_client, resource.id, start_date.isoformat() + "Z", end_date.isoformat() + "Z")
-            metrics = [m for m in [avg_cpu, avg_memory, avg_network] if m is not None]
+            vm_metrics = fetch_resource_metrics(
+                monitor_client, resource.id, VM_METRIC_NAMES,
+                start_iso, end_iso
+            )
+            metrics = list(vm_metrics.values())
             if metrics:
                 total_avg = sum(metrics) / len(metrics)
-                formatted_resource["Current_Avg_VM"] = total_avg
                 if total_avg < VM_UNDERUTILIZED_CPU_THRESHOLD:
+                    formatted_resource = make_formatted()
+                    formatted_resource["Current_Avg_VM"] = total_avg
                     formatted_resource["Finding"] = "VM underutilised"
                     formatted_resource["Recommendation"] = "Scale Down"
-                    underutilized_resources.append(formatted_resource)
                     print(f"[UNDERUTILIZED] VM: {resource.name} - Total Avg: {total_avg:.2f}")
-            continue
+                    return formatted_resource, matched
+            return None, matched
 
         # Managed Disk logic
         if resource.type and "Microsoft.Compute/disks" in resource.type:
-            disk = compute_client.disks.get(resource_group_name=resource.id.split('/')[4], disk_name=resource.name)
+            disk = disks_by_id.get(normalized_id)
+            if disk is None:
+                # Created after the disks.list() snapshot; it'll be seen next scan.
+                return None, matched
             disk_size_gb = disk.disk_size_gb
             disk_status = getattr(disk, "disk_state", None) or getattr(disk, "provisioning_state", None)
             attached = bool(disk.managed_by)
@@ -475,83 +732,46 @@ def analyze_azure_resources():
             if disk_status and disk_status.lower() != "succeeded":
                 underutilized = True
             if underutilized:
+                formatted_resource = make_formatted()
                 formatted_resource["Current_Disk_Size_GB"] = disk_size_gb
                 formatted_resource["Disk_Status"] = disk_status
                 formatted_resource["Disk_Attached"] = attached
                 formatted_resource["Finding"] = "Disk Underutilised"
                 formatted_resource["Recommendation"] = "Scale Down"
-                underutilized_resources.append(formatted_resource)
                 print(f"[UNDERUTILIZED] Disk: {resource.name} - Size: {disk_size_gb}GB, Status: {disk_status}, Attached: {attached}")
-            continue
+                return formatted_resource, matched
+            return None, matched
 
         # --- Universal Database underutilized logic ---
-        if resource.type and (
-            resource.type.startswith("Microsoft.Sql/servers/databases") or
-            resource.type.startswith("Microsoft.DBforMySQL/servers/databases") or
-            resource.type.startswith("Microsoft.DBforPostgreSQL/servers/databases") or
-            resource.type.startswith("Microsoft.DBforMariaDB/servers/databases") or
-            resource.type.startswith("Microsoft.DocumentDB/databaseAccounts") or
-            resource.type.startswith("Microsoft.Cache/Redis") or
-            resource.type.startswith("Microsoft.Synapse/workspaces") or
-            resource.type.startswith("Microsoft.DBforMongoDB/servers/databases")
-        ):
+        if resource_type_value == "Database":
             findings = []
             recommendations = []
+            extras = {}
             current_db_size_gb = None
 
-            # Determine threshold based on DB type
-            if resource.type.startswith("Microsoft.Sql/servers/databases"):
-                db_size_threshold = sql_db_size_threshold
-            elif resource.type.startswith("Microsoft.DBforMySQL/servers/databases"):
-                db_size_threshold = mysql_db_size_threshold
-            elif resource.type.startswith("Microsoft.DBforPostgreSQL/servers/databases"):
-                db_size_threshold = postgres_db_size_threshold
-            elif resource.type.startswith("Microsoft.DBforMariaDB/servers/databases"):
-                db_size_threshold = maria_db_size_threshold
-            elif resource.type.startswith("Microsoft.DocumentDB/databaseAccounts"):
-                db_size_threshold = cosmos_db_size_threshold
-            elif resource.type.startswith("Microsoft.DBforMongoDB/servers/databases"):
-                db_size_threshold = mongo_db_size_threshold
-            elif resource.type.startswith("Microsoft.Synapse/workspaces"):
-                db_size_threshold = synapse_db_size_threshold
-            elif resource.type.startswith("Microsoft.Cache/Redis"):
-                db_size_threshold = redis_db_size_threshold
-            else:
-                db_size_threshold = None
+            # Threshold keyed off the sub-type the dispatch table already gave us
+            db_size_threshold = db_threshold_by_subtype.get(sub_resource_type)
 
             # Fetch current DB size using Azure Monitor 'storage' metric (returns MB)
-            try:
-                metrics_data = monitor_client.metrics.list(
-                    resource.id,
-                    timespan=f"{start_date.isoformat()}Z/{end_date.isoformat()}Z",
-                    interval='PT1H',
-                    metricnames="storage",
-                    aggregation='Average'
-                )
-                storage_mb_values = []
-                for item in metrics_data.value:
-                    for timeserie in item.timeseries:
-                        for data in timeserie.data:
-                            if data.average is not None:
-                                storage_mb_values.append(data.average)
-                if storage_mb_values:
-                    avg_storage_mb = sum(storage_mb_values) / len(storage_mb_values)
-                    current_db_size_gb = avg_storage_mb / 1024  # Convert MB to GB
-            except Exception as e:
-                print(f"[WARNING] Error fetching storage metric for {resource.name}: {e}")
+            avg_storage_mb = fetch_resource_metrics(
+                monitor_client, resource.id, "storage",
+                start_iso, end_iso
+            ).get("storage")
+            if avg_storage_mb is not None:
+                current_db_size_gb = avg_storage_mb / 1024  # Convert MB to GB
             
             # DB underutilized logic
             if db_size_threshold is not None and current_db_size_gb is not None and current_db_size_gb < db_size_threshold:
                 findings.append("DB Underutilised")
                 recommendations.append("Reduce DBSize")
-                formatted_resource["Current_DB_Size_GB"] = current_db_size_gb
+                extras["Current_DB_Size_GB"] = current_db_size_gb
 
             # Untagged logic
-            missing_tags = [tag for tag in REQUIRED_TAG_NAMES if tag not in tags or not tags.get(tag)]
+            missing_tags = _missing_tags(tags)
             if missing_tags:
                 findings.append("Untagged Resource")
                 recommendations.append("Add Tag")
-                formatted_resource["MissingTags"] = "; ".join(missing_tags)
+                extras["MissingTags"] = "; ".join(missing_tags)
 
             # Orphaned logic (for DBs, e.g., check if status is not 'Online')
             db_status = getattr(resource, "status", None) or getattr(resource, "provisioning_state", None)
@@ -560,28 +780,56 @@ def analyze_azure_resources():
                 recommendations.append("Delete")
 
             if findings:
+                formatted_resource = make_formatted()
+                formatted_resource.update(extras)
                 formatted_resource["Finding"] = "; ".join(findings)
                 formatted_resource["Recommendation"] = "; ".join(recommendations)
-                underutilized_resources.append(formatted_resource)
                 print(f"[UNDERUTILIZED] Database: {resource.name} - Findings: {formatted_resource['Finding']}")
-            continue
+                return formatted_resource, matched
+            return None, matched
 
         # Untagged resource logic
-        missing_tags = [tag for tag in REQUIRED_TAG_NAMES if tag not in tags or not tags.get(tag)]
+        missing_tags = _missing_tags(tags)
         if missing_tags:
+            formatted_resource = make_formatted()
             formatted_resource["TotalCost"] = 0 if total_cost == "Unknown" else total_cost
             formatted_resource["Finding"] = "Untagged Resource"
             formatted_resource["MissingTags"] = "; ".join(missing_tags)
             formatted_resource["Recommendation"] = "Add Tag"
-            underutilized_resources.append(formatted_resource)
             print(f"[UNTAGGED] Resource: {resource.name} - Missing tags: {'; '.join(missing_tags)}")
-            continue
+            return formatted_resource, matched
+
+        return None, matched
+
+    # Main resource loop: each iteration blocks on 1-3 Azure REST round-trips,
+    # so fan the per-resource work out over threads and fold results back on
+    # this thread (no locks needed for the counters or the findings list).
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        for formatted, matched in pool.map(process_resource, resource_client.resources.list()):
+            if matched:
+                matched_count += 1
+            else:
+                unmatched_count += 1
+            if formatted is not None:
+                yield formatted
+
+    # The subscription-wide listings below are independent REST calls; start
+    # them all now and block only when each consumer needs its result.
+    list_pool = ThreadPoolExecutor(max_workers=16)
+    vnets_future = list_pool.submit(lambda: list(network_client.virtual_networks.list_all()))
+    nics_future = list_pool.submit(lambda: list(network_client.network_interfaces.list_all()))
+    pips_future = list_pool.submit(lambda: list(network_client.public_ip_addresses.list_all()))
+    nsgs_future = list_pool.submit(lambda: list(network_client.network_security_groups.list_all()))
+    rgs_future = list_pool.submit(lambda: [rg.name for rg in resource_client.resource_groups.list()])
 
     # --- Subnet analysis ---
-    for vnet in network_client.virtual_networks.list_all():
-        vnet_id_parts = vnet.id.split("/")
-        resource_group_name = vnet_id_parts[4]
-        for subnet in network_client.subnets.list(resource_group_name, vnet.name):
+    # virtual_networks.list_all() already hydrates each VNet's subnets, so no
+    # per-VNet subnets.list round-trips are needed at all.
+    vnets = vnets_future.result()
+    for vnet in vnets:
+        resource_group_name = vnet.id.split("/", 5)[4]
+        tags = vnet.tags or {}
+        for subnet in (vnet.subnets or []):
             if "default" in subnet.name.lower():
                 print(f"  • {subnet.name} (Default VPC) - Skipped")
                 continue
@@ -589,24 +837,21 @@ def analyze_azure_resources():
             if not prefix:
                 print(f"  • {subnet.name} (VNet: {vnet.name}) - Skipped (no address prefix)")
                 continue
-            total_ips = ipaddress.ip_network(prefix).num_addresses - 5
-            used_ips = subnet.ip_configurations and len(subnet.ip_configurations) or 0
-            free_ips = total_ips - used_ips
-            free_percent = (free_ips / total_ips) * 100 if total_ips > 0 else 0
+            free_percent = _subnet_free_ip_percent(subnet)
             print(f"  • {subnet.name} (VNet: {vnet.name}) - {free_percent:.2f}% free IPs")
             if free_percent > SUBNET_FREE_IP_THRESHOLD:
                 formatted_resource = {
                     "_id": subnet.id,
                     "CloudProvider": "Azure",
                     "ManagementUnitId": subscription_id,
-                    "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                    "CostCenter": tags.get("CostCenter", "na").lower(),
-                    "CIO": tags.get("CIO", "na").lower(),
-                    "Platform": tags.get("Platform", "na").lower(),
-                    "Lab": tags.get("Lab", "na").lower(),
-                    "Feature": tags.get("Feature", "na").lower(),
-                    "Owner": tags.get("Owner", "na").lower(),
-                    "TicketId": tags.get("Ticket", "na").lower(),
+                    "ApplicationCode": _tag_lower(tags, "ApplicationCode"),
+                    "CostCenter": _tag_lower(tags, "CostCenter"),
+                    "CIO": _tag_lower(tags, "CIO"),
+                    "Platform": _tag_lower(tags, "Platform"),
+                    "Lab": _tag_lower(tags, "Lab"),
+                    "Feature": _tag_lower(tags, "Feature"),
+                    "Owner": _tag_lower(tags, "Owner"),
+                    "TicketId": _tag_lower(tags, "Ticket"),
                     "ResourceType": "Network",
                     "SubResourceType": "subnet",
                     "ResourceName": subnet.name,
@@ -615,364 +860,257 @@ def analyze_azure_resources():
                     "Currency": tags.get("Currency", "usd").upper(),
                     "Finding": "subnet underutilised",
                     "Recommendation": "scale down",
-                    "Environment": tags.get("Environment", "na").lower(),
-                    "Timestamp": datetime.utcnow().isoformat() + "Z",
+                    "Environment": _tag_lower(tags, "Environment"),
+                    "Timestamp": scan_timestamp,
                     "ConfidenceScore": tags.get("ConfidenceScore", "na"),
                     "Status": "available",
-                    "Entity": tags.get("Entity", "na").lower(),
+                    "Entity": _tag_lower(tags, "Entity"),
                     "RootId": tenant_id,
                     "Email": user_email,
                     "Current_Free_IP_Percent": free_percent,
                     "VNet": vnet.name,
                     "ResourceGroup": resource_group_name
                 }
-                underutilized_resources.append(formatted_resource)
+                yield formatted_resource
                 print(f"  ⚠️  {subnet.name} (VNet: {vnet.name}) - {free_percent:.2f}% free IPs (flagged)")
 
     # --- Orphaned resource detection ---
-    # Orphaned Disks
-    for disk in compute_client.disks.list():
+    # Orphaned Disks (reuses the disk map fetched before the main loop)
+    for disk in disks_by_id.values():
         if not disk.managed_by:
-            tags = disk.tags if hasattr(disk, "tags") and disk.tags else {}
-            formatted_resource = {
-                "_id": str(disk.id),
-                "CloudProvider": tags.get("CloudProvider", "Azure"),
-                "ManagementUnitId": subscription_id,
-                "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                "CostCenter": tags.get("CostCenter", "na").lower(),
-                "CIO": tags.get("CIO", "na").lower(),
-                "Platform": tags.get("Platform", "na").lower(),
-                "Lab": tags.get("Lab", "na").lower(),
-                "Feature": tags.get("Feature", "na").lower(),
-                "Owner": tags.get("Owner", "na").lower(),
-                "TicketId": tags.get("Ticket", "na").lower(),
-                "ResourceType": "Storage",
-                "SubResourceType": "Disk",
-                "ResourceName": disk.name,
-                "Region": disk.location,
-                "TotalCost": 0,
-                "Currency": "USD",
-                "Finding": "OrphandResource",
-                "Recommendation": "Delete",
-                "Environment": tags.get("Environment", "na").lower(),
-                "Timestamp": datetime.utcnow().isoformat() + "Z",
-                "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-                "Status": "available",
-                "Entity": tags.get("Entity", "na").lower(),
-                "RootId": tenant_id,
-                "Email": user_email,
-                "Size": f"{disk.disk_size_gb}GB"
-            }
-            underutilized_resources.append(formatted_resource)
+            yield _format_orphan(disk, "Disk", scan_timestamp, resource_type="Storage",
+                                 Size=f"{disk.disk_size_gb}GB")
 
     # Orphaned NICs
-    for nic in network_client.network_interfaces.list_all():
+    all_nics = nics_future.result()
+    for nic in all_nics:
         if not nic.virtual_machine:
-            tags = nic.tags if hasattr(nic, "tags") and nic.tags else {}
-            formatted_resource = {
-                "_id": str(nic.id),
-                "CloudProvider": tags.get("CloudProvider", "Azure"),
-                "ManagementUnitId": subscription_id,
-                "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                "CostCenter": tags.get("CostCenter", "na").lower(),
-                "CIO": tags.get("CIO", "na").lower(),
-                "Platform": tags.get("Platform", "na").lower(),
-                "Lab": tags.get("Lab", "na").lower(),
-                "Feature": tags.get("Feature", "na").lower(),
-                "Owner": tags.get("Owner", "na").lower(),
-                "TicketId": tags.get("Ticket", "na").lower(),
-                "ResourceType": "Network",
-                "SubResourceType": "NIC",
-                "ResourceName": nic.name,
-                "Region": nic.location,
-                "TotalCost": 0,
-                "Currency": "USD",
-                "Finding": "OrphandResource",
-                "Recommendation": "Delete",
-                "Environment": tags.get("Environment", "na").lower(),
-                "Timestamp": datetime.utcnow().isoformat() + "Z",
-                "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-                "Status": "available",
-                "Entity": tags.get("Entity", "na").lower(),
-                "RootId": tenant_id,
-                "Email": user_email,
-                "Size": ""
-            }
-            underutilized_resources.append(formatted_resource)
+            yield _format_orphan(nic, "NIC", scan_timestamp)
 
     # Orphaned Public IPs
-    for pip in network_client.public_ip_addresses.list_all():
+    for pip in pips_future.result():
         if not pip.ip_configuration:
-            tags = pip.tags if hasattr(pip, "tags") and pip.tags else {}
-            formatted_resource = {
-                "_id": str(pip.id),
-                "CloudProvider": tags.get("CloudProvider", "Azure"),
-                "ManagementUnitId": subscription_id,
-                "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                "CostCenter": tags.get("CostCenter", "na").lower(),
-                "CIO": tags.get("CIO", "na").lower(),
-                "Platform": tags.get("Platform", "na").lower(),
-                "Lab": tags.get("Lab", "na").lower(),
-                "Feature": tags.get("Feature", "na").lower(),
-                "Owner": tags.get("Owner", "na").lower(),
-                "TicketId": tags.get("Ticket", "na").lower(),
-                "ResourceType": "Network",
-                "SubResourceType": "PublicIps",
-                "ResourceName": pip.name,
-                "Region": pip.location,
-                "TotalCost": 0,
-                "Currency": "USD",
-                "Finding": "OrphandResource",
-                "Recommendation": "Delete",
-                "Environment": tags.get("Environment", "na").lower(),
-                "Timestamp": datetime.utcnow().isoformat() + "Z",
-                "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-                "Status": "available",
-                "Entity": tags.get("Entity", "na").lower(),
-                "RootId": tenant_id,
-                "Email": user_email,
-                "Size": ""
-            }
-            underutilized_resources.append(formatted_resource)
-
-     # Prepare lists for orphaned NSG analysis
-    all_nsgs = list(network_client.network_security_groups.list_all())
-    all_nics = list(network_client.network_interfaces.list_all())
-    all_vnets = list(network_client.virtual_networks.list_all())
-    all_subnets = []
-    for vnet in all_vnets:
-        rg_name = vnet.id.split("/")[4]
-        all_subnets.extend(list(network_client.subnets.list(rg_name, vnet.name)))
-
-    # Orphaned NSGs
+            yield _format_orphan(pip, "PublicIps", scan_timestamp)
+
+     # Prepare lists for orphaned NSG analysis (NICs/VNets already materialized;
+     # subnets come embedded on the VNet objects, no extra calls)
+    all_nsgs = nsgs_future.result()
+    all_vnets = vnets
+    all_subnets = [subnet for vnet in all_vnets for subnet in (vnet.subnets or [])]
+
+    # Orphaned NSGs: invert the NIC/subnet associations once instead of
+    # rescanning every NIC and subnet per NSG (O(N+M) vs O(N*M)).
+    nsg_nic_counts = collections.defaultdict(int)
+    for nic in all_nics:
+        if nic.network_security_group:
+            nsg_nic_counts[nic.network_security_group.id] += 1
+    nsg_subnet_counts = collections.defaultdict(int)
+    for subnet in all_subnets:
+        if subnet.network_security_group:
+            nsg_subnet_counts[subnet.network_security_group.id] += 1
     for nsg in all_nsgs:
-        nsg_id = nsg.id
-        nsg_nics = [nic for nic in all_nics if nic.network_security_group and nic.network_security_group.id == nsg_id]
-        nsg_subnets = [subnet for subnet in all_subnets if subnet.network_security_group and subnet.network_security_group.id == nsg_id]
         security_rules = getattr(nsg, "security_rules", [])
-        if len(nsg_nics) == 0 and len(nsg_subnets) == 0 and len(security_rules) == 0:
-            tags = nsg.tags if hasattr(nsg, "tags") and nsg.tags else {}
-            formatted_resource = {
-                "_id": str(nsg.id),
-                "CloudProvider": tags.get("CloudProvider", "Azure"),
-                "ManagementUnitId": subscription_id,
-                "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                "CostCenter": tags.get("CostCenter", "na").lower(),
-                "CIO": tags.get("CIO", "na").lower(),
-                "Platform": tags.get("Platform", "na").lower(),
-                "Lab": tags.get("Lab", "na").lower(),
-                "Feature": tags.get("Feature", "na").lower(),
-                "Owner": tags.get("Owner", "na").lower(),
-                "TicketId": tags.get("Ticket", "na").lower(),
-                "ResourceType": "Network",
-                "SubResourceType": "NSG",
-                "ResourceName": nsg.name,
-                "Region": nsg.location,
-                "TotalCost": 0,
-                "Currency": "USD",
-                "Finding": "OrphandResource",
-                "Recommendation": "Delete",
-                "Environment": tags.get("Environment", "na").lower(),
-                "Timestamp": datetime.utcnow().isoformat() + "Z",
-                "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-                "Status": "available",
-                "Entity": tags.get("Entity", "na").lower(),
-                "RootId": tenant_id,
-                "Email": user_email,
-                "Size": ""
-            }
-            underutilized_resources.append(formatted_resource)
+        if not nsg_nic_counts[nsg.id] and not nsg_subnet_counts[nsg.id] and not security_rules:
+            yield _format_orphan(nsg, "NSG", scan_timestamp)
 
     # --- Orphaned NSG Flow Logs ---
     try:
-        # List all resource groups
-        resource_groups = [rg.name for rg in resource_client.resource_groups.list()]
-        all_nsgs = {nsg.id: nsg for nsg in network_client.network_security_groups.list_all()}
-        all_vnets = {vnet.id: vnet for vnet in network_client.virtual_networks.list_all()}
-        for rg_name in resource_groups:
+        # Reuse the already-materialized listings as id lookups
+        resource_groups = rgs_future.result()
+        all_nsgs = {nsg.id: nsg for nsg in all_nsgs}
+        all_vnets = {vnet.id: vnet for vnet in all_vnets}
+
+        def _list_watchers(rg_name):
             try:
-                network_watchers = list(network_client.network_watchers.list(rg_name))
+                return list(network_client.network_watchers.list(rg_name))
             except Exception as e:
                 print(f"[WARNING] Could not list network watchers in resource group {rg_name}: {e}")
-                continue
+                return []
+
+        def _list_flow_logs(nw):
+            try:
+                return list(network_client.flow_logs.list(nw.resource_group_name, nw.name))
+            except Exception as e:
+                print(f"[WARNING] Could not fetch flow logs for Network Watcher {nw.name}: {e}")
+                return []
+
+        watcher_batches = list(list_pool.map(_list_watchers, resource_groups)) if resource_groups else []
+        all_watchers = [nw for batch in watcher_batches for nw in batch]
+        # Fetch every watcher's flow logs concurrently before walking them
+        flow_logs_by_watcher = dict(zip(
+            (nw.id for nw in all_watchers),
+            list_pool.map(_list_flow_logs, all_watchers)
+        )) if all_watchers else {}
+        for network_watchers in watcher_batches:
             for nw in network_watchers:
-                try:
-                    flow_logs = list(network_client.flow_logs.list(nw.resource_group_name, nw.name))
-                except Exception as e:
-                    print(f"[WARNING] Could not fetch flow logs for Network Watcher {nw.name}: {e}")
-                    continue
+                flow_logs = flow_logs_by_watcher.get(nw.id, [])
                 for flow_log in flow_logs:
                     # Orphaned NSG Flow Log
                     if hasattr(flow_log, "network_security_group") and flow_log.network_security_group:
                         nsg_id = flow_log.network_security_group.id
                         if nsg_id not in all_nsgs:
-                            tags = flow_log.tags if hasattr(flow_log, "tags") and flow_log.tags else {}
-                            formatted_resource = {
-                                "_id": str(flow_log.id),
-                                "CloudProvider": tags.get("CloudProvider", "Azure"),
-                                "ManagementUnitId": subscription_id,
-                                "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                                "CostCenter": tags.get("CostCenter", "na").lower(),
-                                "CIO": tags.get("CIO", "na").lower(),
-                                "Platform": tags.get("Platform", "na").lower(),
-                                "Lab": tags.get("Lab", "na").lower(),
-                                "Feature": tags.get("Feature", "na").lower(),
-                                "Owner": tags.get("Owner", "na").lower(),
-                                "TicketId": tags.get("Ticket", "na").lower(),
-                                "ResourceType": "Network",
-                                "SubResourceType": "NSGFlowLog",
-                                "ResourceName": flow_log.name,
-                                "Region": flow_log.location,
-                                "TotalCost": 0,
-                                "Currency": "USD",
-                                "Finding": "OrphandResource",
-                                "Recommendation": "Delete",
-                                "Environment": tags.get("Environment", "na").lower(),
-                                "Timestamp": datetime.utcnow().isoformat() + "Z",
-                                "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-                                "Status": "available",
-                                "Entity": tags.get("Entity", "na").lower(),
-                                "RootId": tenant_id,
-                                "Email": user_email,
-                                "Size": ""
-                            }
-                            underutilized_resources.append(formatted_resource)
+                            yield _format_orphan(flow_log, "NSGFlowLog", scan_timestamp)
                     # Orphaned VNET Flow Log
                     elif hasattr(flow_log, "virtual_network") and flow_log.virtual_network:
                         vnet_id = flow_log.virtual_network.id
                         if vnet_id not in all_vnets:
-                            tags = flow_log.tags if hasattr(flow_log, "tags") and flow_log.tags else {}
-                            formatted_resource = {
-                                "_id": str(flow_log.id),
-                                "CloudProvider": tags.get("CloudProvider", "Azure"),
-                                "ManagementUnitId": subscription_id,
-                                "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                                "CostCenter": tags.get("CostCenter", "na").lower(),
-                                "CIO": tags.get("CIO", "na").lower(),
-                                "Platform": tags.get("Platform", "na").lower(),
-                                "Lab": tags.get("Lab", "na").lower(),
-                                "Feature": tags.get("Feature", "na").lower(),
-                                "Owner": tags.get("Owner", "na").lower(),
-                                "TicketId": tags.get("Ticket", "na").lower(),
-                                "ResourceType": "Network",
-                                "SubResourceType": "VNETFlowLog",
-                                "ResourceName": flow_log.name,
-                                "Region": flow_log.location,
-                                "TotalCost": 0,
-                                "Currency": "USD",
-                                "Finding": "OrphandResource",
-                                "Recommendation": "Delete",
-                                "Environment": tags.get("Environment", "na").lower(),
-                                "Timestamp": datetime.utcnow().isoformat() + "Z",
-                                "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-                                "Status": "available",
-                                "Entity": tags.get("Entity", "na").lower(),
-                                "RootId": tenant_id,
-                                "Email": user_email,
-                                "Size": ""
-                            }
-                            underutilized_resources.append(formatted_resource)
+                            yield _format_orphan(flow_log, "VNETFlowLog", scan_timestamp)
     except Exception as e:
         print(f"[WARNING] Error during orphaned flow log detection: {e}")
+    finally:
+        list_pool.shutdown(wait=False)
 
     # --- Kubernetes nodes underutilized logic ---
-    for cluster in aks_client.managed_clusters.list():
-        resource_group_name = cluster.id.split("/")[4]
+    # All agent-pool listings for the subscription go through the ARM /batch
+    # endpoint (20 GETs per POST) instead of one SDK call per cluster.
+    clusters = list(aks_client.managed_clusters.list())
+    agent_pools_by_cluster = {}
+    if clusters:
+        try:
+            pool_payloads = _batch_get(
+                credential,
+                [f"{cluster.id}/agentPools?api-version=2024-02-01" for cluster in clusters],
+            )
+            for cluster, payload in zip(clusters, pool_payloads):
+                agent_pools_by_cluster[cluster.id] = payload.get("value", [])
+        except Exception as e:
+            print(f"[WARNING] Batched agent-pool fetch failed, falling back to per-cluster calls: {e}")
+            for cluster in clusters:
+                agent_pools_by_cluster[cluster.id] = [
+                    {"id": pool.id, "name": pool.name, "properties": {"count": pool.count}}
+                    for pool in aks_client.agent_pools.list(cluster.id.split("/", 5)[4], cluster.name)
+                ]
+
+    # Resolve the backing node VMs for every cluster first so all their
+    # metric queries can share one multiplexed /batch round trip. The VMSS
+    # listings are independent REST calls, so they fan out across a pool
+    # instead of running M×K sequential round-trips.
+    vmss_targets = []
+    cluster_vm_ids = {}
+    for cluster in clusters:
+        cluster_vm_ids[cluster.id] = []
+        resource_group_name = cluster.id.split("/", 5)[4]
+        for pool in agent_pools_by_cluster.get(cluster.id, []):
+            vmss_id = pool.get("id")
+            if vmss_id and "virtualMachineScaleSets" in vmss_id:
+                vmss_targets.append((cluster.id, resource_group_name, vmss_id.rsplit("/", 1)[-1]))
+            else:
+                print(f"[INFO] Agent pool {pool.get('name')} does not have a VMSS backing or VMSS id not found, skipping node metrics collection for this pool.")
+
+    def list_vmss_vms(target):
+        cluster_id, resource_group_name, vmss_name = target
+        try:
+            return cluster_id, [vm.id for vm in compute_client.virtual_machine_scale_set_vms.list(resource_group_name, vmss_name)]
+        except Exception as e:
+            print(f"[WARNING] Could not list VMs for VMSS {vmss_name}: {e}")
+            return cluster_id, []
+
+    if vmss_targets:
+        with ThreadPoolExecutor(max_workers=min(16, len(vmss_targets))) as vmss_pool:
+            for cluster_id, vm_ids in vmss_pool.map(list_vmss_vms, vmss_targets):
+                cluster_vm_ids[cluster_id].extend(vm_ids)
+
+    all_vm_ids = [vm_id for ids in cluster_vm_ids.values() for vm_id in ids]
+    try:
+        metrics_by_vm = get_aks_node_metrics_batch(credential, all_vm_ids, start_iso, end_iso)
+    except Exception as e:
+        print(f"[WARNING] Batched node metrics fetch failed, falling back to per-node queries: {e}")
+        metrics_by_vm = None
+
+    for cluster in clusters:
         node_count_threshold = k8s_node_count
         cpu_threshold = k8s_node_cpu_percentage
         memory_threshold = k8s_node_memory_percentage
 
-        agent_pools = list(aks_client.agent_pools.list(resource_group_name, cluster.name))
-        actual_node_count = sum(pool.count for pool in agent_pools if pool.count is not None)
-
-        vm_resource_ids = []
-        for pool in agent_pools:
-            vmss_id = pool.id if hasattr(pool, "id") else getattr(pool, "resource_id", None)
-            if vmss_id and "virtualMachineScaleSets" in vmss_id:
-                vmss_name = vmss_id.split("/")[-1]
-                try:
-                    for vm in compute_client.virtual_machine_scale_set_vms.list(resource_group_name, vmss_name):
-                        vm_resource_ids.append(vm.id)
-                except Exception as e:
-                    print(f"[WARNING] Could not list VMs for VMSS {vmss_name}: {e}")
-            else:
-                print(f"[INFO] Agent pool {pool.name} does not have a VMSS backing or VMSS id not found, skipping node metrics collection for this pool.")
-
-    avg_node_cpu, avg_node_memory = get_aks_node_metrics(
-        monitor_client, vm_resource_ids, start_date.isoformat() + "Z", end_date.isoformat() + "Z"
-    )
+        agent_pools = agent_pools_by_cluster.get(cluster.id, [])
+        actual_node_count = sum(
+            pool.get("properties", {}).get("count") or 0 for pool in agent_pools
+        )
 
-    findings = []
-    recommendations = []
-
-    # --- Underutilized logic ---
-    if node_count_threshold is not None and actual_node_count >= node_count_threshold:
-        # If metrics are available, check thresholds
-        if (
-            (avg_node_cpu is not None and cpu_threshold is not None and avg_node_cpu < cpu_threshold) or
-            (avg_node_memory is not None and memory_threshold is not None and avg_node_memory < memory_threshold)
-        ):
-            findings.append("Nodes Underutilized")
-            recommendations.append("Reduce Nodes")
-        # If metrics are missing, still flag as underutilized based on node count alone
-        elif avg_node_cpu is None and avg_node_memory is None:
-            findings.append("Nodes Underutilized")
-            recommendations.append("Reduce Nodes")
-
-    # Untagged logic (for AKS clusters, tags are on the cluster object)
-    tags = cluster.tags if hasattr(cluster, "tags") and cluster.tags else {}
-    missing_tags = [tag for tag in REQUIRED_TAG_NAMES if tag not in tags or not tags.get(tag)]
-    if missing_tags:
-        findings.append("Untagged Resource")
-        recommendations.append("Add Tag")
-
-    # Orphaned AKS Cluster logic
-    provisioning_state = getattr(cluster, "provisioning_state", "").lower()
-    if provisioning_state in ["deleting", "stopping"] or actual_node_count == 0:
-        findings.append("OrphandResource")
-        recommendations.append("Delete")
-
-    if findings:
-        formatted_resource = {
-            "_id": f"k8s_{subscription_id}_{user_email}_{cluster.name}",
-            "CloudProvider": "Azure",
-            "ManagementUnitId": subscription_id,
-            "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-            "CostCenter": tags.get("CostCenter", "na").lower(),
-            "CIO": tags.get("CIO", "na").lower(),
-            "Platform": tags.get("Platform", "na").lower(),
-            "Lab": tags.get("Lab", "na").lower(),
-            "Feature": tags.get("Feature", "na").lower(),
-            "Owner": tags.get("Owner", "na").lower(),
-            "TicketId": tags.get("Ticket", "na").lower(),
-            "ResourceType": "Kubernetes",
-            "SubResourceType": "NodePool",
-            "ResourceName": f"AKS Node Pool ({cluster.name})",
-            "Region": cluster.location,
-            "TotalCost": 0,
-            "Currency": "USD",
-            "Finding": "; ".join(findings),
-            "Recommendation": "; ".join(recommendations),
-            "Timestamp": datetime.utcnow().isoformat() + "Z",
-            "RootId": tenant_id,
-            "Email": user_email,
-            "NodeCount": actual_node_count,
-            "AvgNodeCPU": avg_node_cpu,
-            "AvgNodeMemory": avg_node_memory,
-            "ProvisioningState": getattr(cluster, "provisioning_state", "").lower(),
-        }
-        underutilized_resources.append(formatted_resource)
-        print(f"[UNDERUTILIZED] Kubernetes NodePool - Cluster: {cluster.name}, Nodes: {actual_node_count}, CPU: {avg_node_cpu}, Memory: {avg_node_memory}, Findings: {'; '.join(findings)}")
+        vm_resource_ids = cluster_vm_ids.get(cluster.id, [])
+        if metrics_by_vm is None:
+            avg_node_cpu, avg_node_memory = get_aks_node_metrics(
+                monitor_client, vm_resource_ids, start_iso, end_iso
+            )
+        else:
+            cpu_values = []
+            memory_values = []
+            for vm_id in vm_resource_ids:
+                cpu, mem = metrics_by_vm.get(vm_id, (None, None))
+                if cpu is not None:
+                    cpu_values.append(cpu)
+                if mem is not None:
+                    memory_values.append(mem)
+            avg_node_cpu = sum(cpu_values) / len(cpu_values) if cpu_values else None
+            avg_node_memory = sum(memory_values) / len(memory_values) if memory_values else None
+
+        findings = []
+        recommendations = []
+
+        # --- Underutilized logic ---
+        if node_count_threshold is not None and actual_node_count >= node_count_threshold:
+            # If metrics are available, check thresholds
+            if (
+                (avg_node_cpu is not None and cpu_threshold is not None and avg_node_cpu < cpu_threshold) or
+                (avg_node_memory is not None and memory_threshold is not None and avg_node_memory < memory_threshold)
+            ):
+                findings.append("Nodes Underutilized")
+                recommendations.append("Reduce Nodes")
+            # If metrics are missing, still flag as underutilized based on node count alone
+            elif avg_node_cpu is None and avg_node_memory is None:
+                findings.append("Nodes Underutilized")
+                recommendations.append("Reduce Nodes")
+
+        # Untagged logic (for AKS clusters, tags are on the cluster object)
+        tags = cluster.tags if hasattr(cluster, "tags") and cluster.tags else {}
+        missing_tags = _missing_tags(tags)
+        if missing_tags:
+            findings.append("Untagged Resource")
+            recommendations.append("Add Tag")
 
-    # --- Orphaned AKS Cluster detection ---
-    for cluster in aks_client.managed_clusters.list():
-        resource_group_name = cluster.id.split("/")[4]
+        # Orphaned AKS Cluster logic
         provisioning_state = getattr(cluster, "provisioning_state", "").lower()
-        agent_pools = list(aks_client.agent_pools.list(resource_group_name, cluster.name))
-        actual_node_count = sum(pool.count for pool in agent_pools if pool.count is not None)
+        is_orphaned = provisioning_state in ["deleting", "stopping"] or actual_node_count == 0
+        if is_orphaned:
+            findings.append("OrphandResource")
+            recommendations.append("Delete")
 
-        if provisioning_state in ["deleting", "stopping"] or actual_node_count == 0:
+        if findings:
             formatted_resource = {
+                "_id": f"k8s_{subscription_id}_{user_email}_{cluster.name}",
+                "CloudProvider": "Azure",
+                "ManagementUnitId": subscription_id,
+                "ApplicationCode": _tag_lower(tags, "ApplicationCode"),
+                "CostCenter": _tag_lower(tags, "CostCenter"),
+                "CIO": _tag_lower(tags, "CIO"),
+                "Platform": _tag_lower(tags, "Platform"),
+                "Lab": _tag_lower(tags, "Lab"),
+                "Feature": _tag_lower(tags, "Feature"),
+                "Owner": _tag_lower(tags, "Owner"),
+                "TicketId": _tag_lower(tags, "Ticket"),
+                "ResourceType": "Kubernetes",
+                "SubResourceType": "NodePool",
+                "ResourceName": f"AKS Node Pool ({cluster.name})",
+                "Region": cluster.location,
+                "TotalCost": 0,
+                "Currency": "USD",
+                "Finding": "; ".join(findings),
+                "Recommendation": "; ".join(recommendations),
+                "Timestamp": scan_timestamp,
+                "RootId": tenant_id,
+                "Email": user_email,
+                "NodeCount": actual_node_count,
+                "AvgNodeCPU": avg_node_cpu,
+                "AvgNodeMemory": avg_node_memory,
+                "ProvisioningState": provisioning_state,
+            }
+            yield formatted_resource
+            print(f"[UNDERUTILIZED] Kubernetes NodePool - Cluster: {cluster.name}, Nodes: {actual_node_count}, CPU: {avg_node_cpu}, Memory: {avg_node_memory}, Findings: {'; '.join(findings)}")
+
+        # Orphaned cluster record, emitted in the same pass instead of
+        # re-listing every cluster and its agent pools a second time.
+        if is_orphaned:
+            yield {
                 "_id": f"aks_orphaned_{subscription_id}_{user_email}_{cluster.name}",
                 "CloudProvider": "Azure",
                 "ManagementUnitId": subscription_id,
@@ -984,122 +1122,138 @@ def analyze_azure_resources():
                 "Currency": "USD",
                 "Finding": "OrphandResource",
                 "Recommendation": "Delete",
-                "Timestamp": datetime.utcnow().isoformat() + "Z",
+                "Timestamp": scan_timestamp,
                 "RootId": tenant_id,
                 "Email": user_email,
                 "NodeCount": actual_node_count,
                 "ProvisioningState": provisioning_state
             }
-            underutilized_resources.append(formatted_resource)
             print(f"[ORPHANED] AKS Cluster: {cluster.name} - State: {provisioning_state}, Nodes: {actual_node_count}")
 
-    # --- Container image size analysis --- 
-    minimal_image_map = {
-    "ubuntu": ("ubuntu:minimal", 29),
-    "debian": ("debian:slim", 22),
-    "python": ("python:slim", 40),
-    "node": ("node:alpine", 5),
-    "golang": ("golang:alpine", 5),
-    "nginx": ("nginx:alpine", 5),
-    "httpd": ("httpd:alpine", 5),
-    "openjdk": ("openjdk:alpine", 10),
-    "mysql": ("mysql:8.0-slim", 40),
-    "redis": ("redis:alpine", 5),
-    "busybox": ("busybox", 1),
-    "scratch": ("scratch", 0),
-    "distroless/base": ("gcr.io/distroless/base", 20)
-    }
-
+    # --- Container image size analysis ---
     for registry in container_registry_client.registries.list():
         registry_name = registry.name
         endpoint = f"https://{registry_name}.azurecr.io"
         print(f"[INFO] Checking registry: {endpoint}")
         try:
-            acr_client = ContainerRegistryClient(endpoint, DefaultAzureCredential())
-            for repo_name in acr_client.list_repository_names():
-                for manifest in acr_client.list_manifest_properties(repo_name):
+            acr_client = _get_acr_client(endpoint)
+            registry_tags = registry.tags if hasattr(registry, "tags") and registry.tags else {}
+
+            def scan_repo(repo_name):
+                # The base-image match depends only on the repo name; one
+                # compiled-regex scan rejects the common no-match repo instead
+                # of 13 substring probes, and only hits build the match list.
+                repo_lower = repo_name.lower()
+                if not _BASE_IMAGE_RE.search(repo_lower):
+                    return repo_name, [], []
+                base_matches = [
+                    (minimal_alt, minimal_size)
+                    for base_image, (minimal_alt, minimal_size) in MINIMAL_IMAGE_MAP.items()
+                    if base_image in repo_lower
+                ]
+                return repo_name, base_matches, list(acr_client.list_manifest_properties(repo_name))
+
+            # Each repo's manifest listing is an independent paged API call, so
+            # fan them out and yield from the main thread as results land.
+            repos = list(acr_client.list_repository_names())
+            with ThreadPoolExecutor(max_workers=min(32, max(len(repos), 1))) as repo_pool:
+                repo_results = repo_pool.map(scan_repo, repos)
+            for repo_name, base_matches, manifests in repo_results:
+                for manifest in manifests:
                     image_size_mb = manifest.size_in_bytes / (1024 * 1024)
-                    if manifest.tags:
-                        for tag in manifest.tags:
-                            for base_image, (minimal_alt, minimal_size) in minimal_image_map.items():
-                                if base_image in repo_name.lower():
-                                    # Use Azure resource ID style for _id
-                                    image_id = (
-                                        f"/subscriptions/{subscription_id}/resourceGroups/{registry_name}"
-                                        f"/providers/Microsoft.ContainerRegistry/registries/{registry_name}"
-                                        f"/repositories/{repo_name}/tags/{tag}"
-                                    )
-                                    if image_size_mb > IMAGE_SIZE_THRESHOLD_MB:
-                                        tags = registry.tags if hasattr(registry, "tags") and registry.tags else {}
-                                        formatted_resource = {
-                                            "_id": image_id,
-                                            "CloudProvider": tags.get("CloudProvider", "Azure"),
-                                            "ManagementUnitId": subscription_id,
-                                            "ApplicationCode": tags.get("ApplicationCode", ""),
-                                            "CostCenter": tags.get("CostCenter", ""),
-                                            "CIO": tags.get("CIO", ""),
-                                            "Platform": tags.get("Platform", ""),
-                                            "Lab": tags.get("Lab", ""),
-                                            "Feature": tags.get("Feature", ""),
-                                            "Owner": tags.get("Owner", ""),
-                                            "TicketId": tags.get("Ticket", ""),
-                                            "ResourceType": "ContainerRegistry",
-                                            "SubResourceType": "Image",
-                                            "ResourceName": f"{repo_name}:{tag}",
-                                            "Region": getattr(registry, "location", ""),
-                                            "TotalCost": 0,
-                                            "Currency": tags.get("Currency", "USD"),
-                                            "Finding": "Image Size High",
-                                            "Recommendation": f"Use Alternate Image;{minimal_alt}",
-                                            "Environment": tags.get("Environment", ""),
-                                            "Timestamp": datetime.utcnow().isoformat() + "Z",
-                                            "ConfidenceScore": tags.get("ConfidenceScore", ""),
-                                            "Status": "available",
-                                            "Entity": tags.get("Entity", ""),
-                                            "RootId": tenant_id,
-                                            "Email": user_email,
-                                            "ImageSizeMB": image_size_mb,
-                                            "MinimalAlternative": minimal_alt
-                                        }
-                                        underutilized_resources.append(formatted_resource)
-                                        print(f"[CONTAINER] {repo_name}:{tag} - Size: {image_size_mb:.2f}MB - Recommend: {minimal_alt}")
+                    if image_size_mb <= IMAGE_SIZE_THRESHOLD_MB or not manifest.tags:
+                        continue
+                    for tag in manifest.tags:
+                        for minimal_alt, minimal_size in base_matches:
+                            # Use Azure resource ID style for _id
+                            image_id = (
+                                f"/subscriptions/{subscription_id}/resourceGroups/{registry_name}"
+                                f"/providers/Microsoft.ContainerRegistry/registries/{registry_name}"
+                                f"/repositories/{repo_name}/tags/{tag}"
+                            )
+                            formatted_resource = {
+                                "_id": image_id,
+                                "CloudProvider": registry_tags.get("CloudProvider", "Azure"),
+                                "ManagementUnitId": subscription_id,
+                                "ApplicationCode": registry_tags.get("ApplicationCode", ""),
+                                "CostCenter": registry_tags.get("CostCenter", ""),
+                                "CIO": registry_tags.get("CIO", ""),
+                                "Platform": registry_tags.get("Platform", ""),
+                                "Lab": registry_tags.get("Lab", ""),
+                                "Feature": registry_tags.get("Feature", ""),
+                                "Owner": registry_tags.get("Owner", ""),
+                                "TicketId": registry_tags.get("Ticket", ""),
+                                "ResourceType": "ContainerRegistry",
+                                "SubResourceType": "Image",
+                                "ResourceName": f"{repo_name}:{tag}",
+                                "Region": getattr(registry, "location", ""),
+                                "TotalCost": 0,
+                                "Currency": registry_tags.get("Currency", "USD"),
+                                "Finding": "Image Size High",
+                                "Recommendation": f"Use Alternate Image;{minimal_alt}",
+                                "Environment": registry_tags.get("Environment", ""),
+                                "Timestamp": scan_timestamp,
+                                "ConfidenceScore": registry_tags.get("ConfidenceScore", ""),
+                                "Status": "available",
+                                "Entity": registry_tags.get("Entity", ""),
+                                "RootId": tenant_id,
+                                "Email": user_email,
+                                "ImageSizeMB": image_size_mb,
+                                "MinimalAlternative": minimal_alt
+                            }
+                            yield formatted_resource
+                            print(f"[CONTAINER] {repo_name}:{tag} - Size: {image_size_mb:.2f}MB - Recommend: {minimal_alt}")
         except Exception as e:
             print(f"[WARNING] Could not connect to registry {endpoint}: {e}")
 
-    # --- Merge findings and recommendations by _id ---
-    merged_resources = {}
-    for res in underutilized_resources:
-        key = res["_id"]
-        if key in merged_resources:
-            # Merge Finding
-            existing_finding = merged_resources[key].get("Finding", "")
-            new_finding = res.get("Finding", "")
-            findings_set = set(existing_finding.split(";")) | set(new_finding.split(";"))
-            merged_resources[key]["Finding"] = ";".join([f for f in findings_set if f])
-
-            # Merge Recommendation
-            existing_recommendation = merged_resources[key].get("Recommendation", "")
-            new_recommendation = res.get("Recommendation", "")
-            recommendations_set = set(existing_recommendation.split(";")) | set(new_recommendation.split(";"))
-            merged_resources[key]["Recommendation"] = ";".join([r for r in recommendations_set if r])
-
-            # Merge MissingTags if present
-            if "MissingTags" in res:
-                existing_tags = merged_resources[key].get("MissingTags", "")
-                new_tags = res.get("MissingTags", "")
-                tags_set = set(existing_tags.split(";")) | set(new_tags.split(";"))
-                merged_resources[key]["MissingTags"] = ";".join([t for t in tags_set if t])
-        else:
-            merged_resources[key] = res
+    # --- Scan summary ---
+    print(f"[INFO] Total resources processed: {matched_count + unmatched_count}")
+    print(f"[INFO] Matched resources with cost data: {matched_count}")
+    print(f"[INFO] Unmatched resources (no cost data): {unmatched_count}")
+
+
+def _fold_finding(merged_resources, res):
+    """Merge one finding into the accumulator, combining duplicates by _id."""
+    key = res["_id"]
+    if key in merged_resources:
+        # Merge Finding
+        existing_finding = merged_resources[key].get("Finding", "")
+        new_finding = res.get("Finding", "")
+        findings_set = set(existing_finding.split(";")) | set(new_finding.split(";"))
+        merged_resources[key]["Finding"] = ";".join([f for f in findings_set if f])
+
+        # Merge Recommendation
+        existing_recommendation = merged_resources[key].get("Recommendation", "")
+        new_recommendation = res.get("Recommendation", "")
+        recommendations_set = set(existing_recommendation.split(";")) | set(new_recommendation.split(";"))
+        merged_resources[key]["Recommendation"] = ";".join([r for r in recommendations_set if r])
+
+        # Merge MissingTags if present
+        if "MissingTags" in res:
+            existing_tags = merged_resources[key].get("MissingTags", "")
+            new_tags = res.get("MissingTags", "")
+            tags_set = set(existing_tags.split(";")) | set(new_tags.split(";"))
+            merged_resources[key]["MissingTags"] = ";".join([t for t in tags_set if t])
+    else:
+        merged_resources[key] = res
+
 
+def analyze_azure_resources():
+    # Consume the scan as a stream, merging duplicates by _id on the fly so
+    # only the merged documents are ever held, never the raw finding list.
+    merged_resources = {}
+    for res in _scan_findings():
+        _fold_finding(merged_resources, res)
     underutilized_resources = list(merged_resources.values())
 
     # --- Save to JSON ---
     filename = "azure_underutilised.json"
     if underutilized_resources:
         try:
-            with open(filename, 'w') as f:
-                json.dump(underutilized_resources, f, indent=2, default=str)
+            # orjson serializes in one C pass; default=str covers the datetime
+            # and Azure SDK values just like the stdlib dump did.
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(underutilized_resources, default=str, option=orjson.OPT_INDENT_2))
             print(f"[INFO] Saved {len(underutilized_resources)} underutilized resources to {filename}")
         except Exception as e:
             print(f"[ERROR] Failed to save underutilized resources to JSON: {e}")
@@ -1108,27 +1262,41 @@ def analyze_azure_resources():
 
     # --- Insert into MongoDB ---
     try:
-        json_test = json.dumps(underutilized_resources, default=str)
-        print("[INFO] JSON validation passed - data is valid for MongoDB insertion")
         filter_query = {
             "CloudProvider": "Azure",
             "ManagementUnitId": subscription_id,
             "Email": user_email
         }
-        existing_count = cost_insights_collection.count_documents(filter_query)
-        if existing_count > 0:
-            cost_insights_collection.delete_many(filter_query)
-            print(f"[INFO] Cleared {existing_count} existing records from Cost_Insights collection")
-        else:
-            print("[INFO] Collection is empty, no records to clear")
         if underutilized_resources:
-            cost_insights_collection.insert_many(underutilized_resources)
-            print(f"[INFO] Inserted {len(underutilized_resources)} underutilized resources into database")
+            # Upsert in bounded batches instead of one insert_many so a large
+            # scan never builds a single oversized wire message, and a failed
+            # batch doesn't abort the rest (ordered=False).
+            ops = [
+                UpdateOne(
+                    {"_id": res["_id"]},
+                    {"$set": {k: v for k, v in res.items() if k != "_id"}},
+                    upsert=True
+                )
+                for res in underutilized_resources
+            ]
+            written = 0
+            for i in range(0, len(ops), BULK_WRITE_BATCH_SIZE):
+                result = cost_insights_collection.bulk_write(ops[i:i + BULK_WRITE_BATCH_SIZE], ordered=False)
+                written += result.upserted_count + result.modified_count
+            print(f"[INFO] Upserted {len(underutilized_resources)} underutilized resources into database ({written} writes acknowledged)")
+            # Every record from this run carries the same Timestamp, so rows
+            # the scan no longer produced can be retired after the upserts
+            # instead of wiping the collection up front. The UI never sees an
+            # empty window between the delete and the re-insert.
+            scan_timestamp = underutilized_resources[0]["Timestamp"]
+            stale = cost_insights_collection.delete_many(
+                {**filter_query, "Timestamp": {"$ne": scan_timestamp}}
+            )
+            if stale.deleted_count:
+                print(f"[INFO] Retired {stale.deleted_count} stale records from Cost_Insights collection")
         else:
-            print("[INFO] No underutilized resources found to insert")
-    except json.JSONEncodeError as e:
-        print(f"[ERROR] JSON validation failed: {e}")
-        print("[ERROR] Skipping MongoDB insertion due to invalid JSON data")
+            cleared = cost_insights_collection.delete_many(filter_query)
+            print(f"[INFO] No underutilized resources found; cleared {cleared.deleted_count} existing records")
     except Exception as e:
         print(f"[ERROR] Failed to insert data into database: {e}")
 
@@ -1140,13 +1308,32 @@ def analyze_azure_resources():
         print(f"[WARNING] Error closing MongoDB connection: {e}")
 
     # --- Final summary ---
-    print(f"[INFO] Total resources processed: {matched_count + unmatched_count}")
-    print(f"[INFO] Matched resources with cost data: {matched_count}")
-    print(f"[INFO] Unmatched resources (no cost data): {unmatched_count}")
     print(f"[INFO] Underutilized/Orphaned resources: {len(underutilized_resources)}")
     print("[INFO] Azure resource optimization analysis completed.")
 
 
-if __name__ == "__main__":
+def run(client_id, client_secret, tenant_id, subscription_id, email,
+        mongo_uri="mongodb://localhost:27017/", db_name="myDB"):
+    """Entry point for in-process invocation (e.g. from Agent.py's worker pool).
+
+    Avoids paying interpreter startup + SDK imports per scan and lets the
+    credential/connection caches survive between runs.
+    """
+    _configure(client_id, client_secret, tenant_id, subscription_id, email, mongo_uri, db_name)
     analyze_azure_resources()
 
+
+if __name__ == "__main__":
+    # Thin CLI shim around run()
+    parser = argparse.ArgumentParser(description="Azure Resource Optimization Script")
+    parser.add_argument("--client_id", required=True, help="Azure Client ID")
+    parser.add_argument("--client_secret", required=True, help="Azure Client Secret")
+    parser.add_argument("--tenant_id", required=True, help="Azure Tenant ID")
+    parser.add_argument("--subscription_id", required=True, help="Azure Subscription ID")
+    parser.add_argument("--email", required=True, help="User Email for filtering configs")
+    parser.add_argument("--mongo_uri", default="mongodb://localhost:27017/", help="MongoDB connection URI")
+    parser.add_argument("--db_name", default="myDB", help="MongoDB database name")
+    args = parser.parse_args()
+    run(args.client_id, args.client_secret, args.tenant_id, args.subscription_id,
+        args.email, args.mongo_uri, args.db_name)
+
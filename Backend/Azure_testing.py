@@ -9,9 +9,10 @@ from azure.mgmt.storage import StorageManagementClient
 from azure.mgmt.monitor import MonitorManagementClient
 from azure.mgmt.compute import ComputeManagementClient
 from azure.mgmt.network import NetworkManagementClient
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 import os
 import ipaddress
+from concurrent.futures import ThreadPoolExecutor
 
 # --- MongoDB connection details ---
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
@@ -32,16 +33,20 @@ VM_UNDERUTILIZED_NETWORK_THRESHOLD = 40
 VM_UNDERUTILIZED_TOTAL_AVG_THRESHOLD = 30
 SUBNET_FREE_IP_THRESHOLD = 90  # percent
 DISK_QUOTA_GB = int(os.getenv("DISK_QUOTA_GB", 100))  # Default to 100GB if not set
+BULK_WRITE_BATCH_SIZE = 1000
 
 try:
     client.admin.command('ismaster')
     print(f"MongoDB connection to {MONGO_URI} established successfully.")
+    cost_insights_collection.create_index([("Email", 1), ("ResourceType", 1)])
 except Exception as e:
     print(f"MongoDB connection failed: {e}")
 
+# Zero-width space, non-breaking space and ordinary whitespace.
+_NORM_RE = re.compile(r'[\u200b\xa0\s]+')
+
 def normalize_resource_id(resource_id):
-    clean_id = re.sub(r'[\u200b\xa0\s]+', '', resource_id)
-    return clean_id.strip().rstrip('/').lower()
+    return _NORM_RE.sub('', resource_id).rstrip('/').lower()
 
 def get_storage_account_size(storage_client, resource_group_name, storage_account_name):
     """Get the total used capacity of a storage account in GB."""
@@ -71,75 +76,31 @@ def get_storage_account_size(storage_client, resource_group_name, storage_accoun
         print(f"Error getting storage account size for {storage_account_name}: {e}")
         return None
 
-def get_vm_average_cpu(monitor_client, resource_id, start_time, end_time):
-    """Fetch average CPU utilization for a VM over a period."""
-    try:
-        metrics_data = monitor_client.metrics.list(
-            resource_id,
-            timespan=f"{start_time}/{end_time}",
-            interval='PT1H',
-            metricnames='Percentage CPU',
-            aggregation='Average'
-        )
-        values = []
-        for item in metrics_data.value:
-            for timeserie in item.timeseries:
-                for data in timeserie.data:
-                    if data.average is not None:
-                        values.append(data.average)
-        if values:
-            return sum(values) / len(values)
-        return None
-    except Exception as e:
-        print(f"Error fetching CPU metrics for {resource_id}: {e}")
-        return None
-
-def get_vm_average_memory(monitor_client, resource_id, start_time, end_time):
-    """Fetch average memory utilization for a VM over a period."""
-    try:
-        metrics_data = monitor_client.metrics.list(
-            resource_id,
-            timespan=f"{start_time}/{end_time}",
-            interval='PT1H',
-            metricnames='Available Memory Bytes',
-            aggregation='Average'
-        )
-        values = []
-        for item in metrics_data.value:
-            for timeserie in item.timeseries:
-                for data in timeserie.data:
-                    if data.average is not None:
-                        values.append(data.average)
-        if values:
-            # Convert bytes to percent if total memory is known, else just return average bytes
-            return sum(values) / len(values)
-        return None
-    except Exception as e:
-        print(f"Error fetching Memory metrics for {resource_id}: {e}")
-        return None
+def get_vm_average_metrics(monitor_client, resource_id, start_time, end_time):
+    """Fetch average CPU/memory/network utilization for a VM in one Monitor call.
 
-def get_vm_average_network(monitor_client, resource_id, start_time, end_time):
-    """Fetch average network utilization for a VM over a period."""
+    Returns a dict keyed by metric name; metrics with no data are absent.
+    """
+    averages = {}
     try:
         metrics_data = monitor_client.metrics.list(
             resource_id,
             timespan=f"{start_time}/{end_time}",
             interval='PT1H',
-            metricnames='Network In Total',
+            metricnames='Percentage CPU,Available Memory Bytes,Network In Total',
             aggregation='Average'
         )
-        values = []
         for item in metrics_data.value:
+            values = []
             for timeserie in item.timeseries:
                 for data in timeserie.data:
                     if data.average is not None:
                         values.append(data.average)
-        if values:
-            return sum(values) / len(values)
-        return None
+            if values:
+                averages[item.name.value] = sum(values) / len(values)
     except Exception as e:
-        print(f"Error fetching Network metrics for {resource_id}: {e}")
-        return None
+        print(f"Error fetching metrics for {resource_id}: {e}")
+    return averages
 
 def get_subnet_free_ip_percent(network_client, resource_group, vnet_name, subnet_name):
     """Returns the percent of free IPs in the subnet."""
@@ -237,18 +198,63 @@ def analyze_azure_resources():
             cost_val = row[cost_idx]
             resource_cost_map[rid] = cost_val
 
+    # One disks.list() replaces a disks.get() per disk in the loop below; the
+    # listing already carries size/state/managed_by.
+    disks_by_id = {normalize_resource_id(d.id): d for d in compute_client.disks.list()}
+
     matched_count = 0
     unmatched_count = 0
     underutilized_storage_accounts = []
 
-    # Iterate and format output
-    for resource in resource_client.resources.list():
+    def make_finding(res_id, name, region, tags, **overrides):
+        """Common finding-document shape; overrides fill the per-type fields."""
+        doc = {
+            "_id": str(res_id),
+            "CloudProvider": tags.get("CloudProvider", "Azure"),
+            "ManagementUnitId": subscription_id,
+            "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
+            "CostCenter": tags.get("CostCenter", "na").lower(),
+            "CIO": tags.get("CIO", "na").lower(),
+            "Platform": tags.get("Platform", "na").lower(),
+            "Lab": tags.get("Lab", "na").lower(),
+            "Feature": tags.get("Feature", "na").lower(),
+            "Owner": tags.get("Owner", "na").lower(),
+            "TicketId": tags.get("Ticket", "na").lower(),
+            "ResourceType": "Unknown",
+            "SubResourceType": "unknown",
+            "ResourceName": name,
+            "Region": region if region else "na",
+            "TotalCost": "na",
+            "Currency": tags.get("Currency", "usd").upper(),
+            "Finding": "",
+            "Recommendation": "",
+            "Environment": tags.get("Environment", "na").lower(),
+            "Timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "ConfidenceScore": tags.get("ConfidenceScore", "na"),
+            "Status": tags.get("Status", "available").lower(),
+            "Entity": tags.get("Entity", "na").lower(),
+            "RootId": tenant_id,
+            "Email": env.get("email", "")
+        }
+        doc.update(overrides)
+        return doc
+
+    def analyze_resource(resource):
+        """Per-resource scan body; returns (finding or None, matched)."""
         tags = resource.tags or {}
-        type_parts = resource.type.split("/") if resource.type else ["Unknown", "Unknown"]
+        # Parse the id/type once; the branch checks below reuse these flags
+        # instead of re-splitting and re-scanning the strings.
+        rtype = resource.type or ""
+        rtype_lower = rtype.lower()
+        rid_parts = resource.id.split('/')
+        is_storage = rtype_lower.startswith("microsoft.storage/storageaccounts")
+        is_vm = rtype_lower.startswith("microsoft.compute/virtualmachines")
+        is_disk = rtype_lower.startswith("microsoft.compute/disks")
+        type_parts = rtype.split("/") if rtype else ["Unknown", "Unknown"]
         resource_type = type_parts[0].replace("Microsoft.", "").capitalize() if len(type_parts) > 0 else "Unknown"
         
         # Set SubResourceType to "bucket" for storage accounts, otherwise use original logic
-        if resource.type and "Microsoft.Storage/storageAccounts" in resource.type:
+        if is_storage:
             sub_resource_type = "bucket"
         else:
             sub_resource_type = type_parts[1][0].upper() + type_parts[1][1:] if len(type_parts) > 1 else "Unknown"
@@ -256,13 +262,10 @@ def analyze_azure_resources():
         normalized_id = normalize_resource_id(resource.id)
         total_cost = resource_cost_map.get(normalized_id, "Unknown")
 
-        if total_cost == "Unknown":
-            unmatched_count += 1
-        else:
-            matched_count += 1
+        matched = total_cost != "Unknown"
 
         # Set specific values for storage accounts vs other resources
-        if resource.type and "Microsoft.Storage/storageAccounts" in resource.type:
+        if is_storage:
             finding_value = "Bucket underutilised"
             recommendation_value = "Try Merging"
             resource_type_value = "Storage"
@@ -271,66 +274,37 @@ def analyze_azure_resources():
             recommendation_value = tags.get("Recommendation", "review usage").lower()
             resource_type_value = resource_type.lower()
 
-        formatted_resource = {
-            "_id": str(resource.id),
-            "CloudProvider": tags.get("CloudProvider", "Azure"),
-            "ManagementUnitId": subscription_id,
-            "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-            "CostCenter": tags.get("CostCenter", "na").lower(),
-            "CIO":tags.get("CIO", "na").lower(),
-            "Platform":tags.get("Platform", "na").lower(),
-            "Lab":tags.get("Lab", "na").lower(),
-            "Feature":tags.get("Feature", "na").lower(),
-            "Owner": tags.get("Owner", "na").lower(),
-            "TicketId": tags.get("Ticket", "na").lower(),
-            "ResourceType": resource_type_value.capitalize(),
-            "SubResourceType": sub_resource_type.lower(),
-            "ResourceName": resource.name,
-            "Region": resource.location if resource.location else "na",
-            "TotalCost": total_cost,
-            "Currency": tags.get("Currency", "usd").upper(),
-            "Finding": finding_value,
-            "Recommendation": recommendation_value,
-            "Environment": tags.get("Environment", "na").lower(),
-            "Timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-            "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-            "Status": tags.get("Status", "available").lower(),
-            "Entity": tags.get("Entity", "na").lower(),
-            "RootId": tenant_id,            
-            "Email": env.get("email", "")      
-        }
+        formatted_resource = make_finding(
+            resource.id, resource.name, resource.location, tags,
+            ResourceType=resource_type_value.capitalize(),
+            SubResourceType=sub_resource_type.lower(),
+            TotalCost=total_cost,
+            Finding=finding_value,
+            Recommendation=recommendation_value
+        )
 
         # Check if this is a storage account and handle filtering
-        if resource.type and "Microsoft.Storage/storageAccounts" in resource.type:
-            resource_group_name = resource.id.split('/')[4] if len(resource.id.split('/')) > 4 else None
+        if is_storage:
+            resource_group_name = rid_parts[4] if len(rid_parts) > 4 else None
             if resource_group_name:
                 storage_size_gb = get_storage_account_size(storage_client, resource_group_name, resource.name)
                 if storage_size_gb is not None and storage_size_gb < sc_stor_size_in_gb:
                     formatted_resource["Current_Size"] = storage_size_gb
                     print(f"[UNDERUTILIZED] Storage Account: {resource.name} - Size: {storage_size_gb}GB")
-                    underutilized_storage_accounts.append(formatted_resource)
-            continue
+                    return formatted_resource, matched
+            return None, matched
 
         # --- Virtual Machine logic ---
-        if resource.type and "Microsoft.Compute/virtualMachines" in resource.type:
-            avg_cpu = get_vm_average_cpu(
-                monitor_client,
-                resource.id,
-                start_date.isoformat() + "Z",
-                end_date.isoformat() + "Z"
-            )
-            avg_memory = get_vm_average_memory(
-                monitor_client,
-                resource.id,
-                start_date.isoformat() + "Z",
-                end_date.isoformat() + "Z"
-            )
-            avg_network = get_vm_average_network(
+        if is_vm:
+            vm_metrics = get_vm_average_metrics(
                 monitor_client,
                 resource.id,
                 start_date.isoformat() + "Z",
                 end_date.isoformat() + "Z"
             )
+            avg_cpu = vm_metrics.get('Percentage CPU')
+            avg_memory = vm_metrics.get('Available Memory Bytes')
+            avg_network = vm_metrics.get('Network In Total')
 
             metrics = [m for m in [avg_cpu, avg_memory, avg_network] if m is not None]
             if metrics:
@@ -340,14 +314,15 @@ def analyze_azure_resources():
                 if total_avg > VM_UNDERUTILIZED_TOTAL_AVG_THRESHOLD:
                     formatted_resource["Finding"] = "VM underutilised"
                     formatted_resource["Recommendation"] = "Scale Down"
-                    underutilized_storage_accounts.append(formatted_resource)
                     print(f"[UNDERUTILIZED] VM: {resource.name} - Total Avg: {total_avg:.2f}")
-            continue
+                    return formatted_resource, matched
+            return None, matched
 
         # --- Managed Disk logic ---
-        if resource.type and "Microsoft.Compute/disks" in resource.type:
-            # Get disk details
-            disk = compute_client.disks.get(resource_group_name=resource.id.split('/')[4], disk_name=resource.name)
+        if is_disk:
+            disk = disks_by_id.get(normalize_resource_id(resource.id))
+            if disk is None:
+                return None, matched
             disk_size_gb = disk.disk_size_gb
             disk_status = getattr(disk, "disk_state", None) or getattr(disk, "provisioning_state", None)
             attached = bool(disk.managed_by)
@@ -377,17 +352,33 @@ def analyze_azure_resources():
                 formatted_resource["Disk_Attached"] = attached
                 formatted_resource["Finding"] = ", ".join(findings)
                 formatted_resource["Recommendation"] = ", ".join(recommendations)
-                underutilized_storage_accounts.append(formatted_resource)
                 print(f"[UNDERUTILIZED] Disk: {resource.name} - Size: {disk_size_gb}GB, Status: {disk_status}, Attached: {attached}")
-            continue
-
-        # Don't insert any resources into database during resource loop - only JSON data will be inserted
+                return formatted_resource, matched
+            return None, matched
+
+        return None, matched
+
+    # The per-resource work is pure ARM I/O, so overlap it across a thread
+    # pool instead of paying one round trip at a time. The mgmt clients are
+    # thread-safe for reads and shared across workers.
+    max_workers = int(os.environ.get("AZURE_PARALLEL", "24"))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for finding, matched in executor.map(analyze_resource, list(resource_client.resources.list())):
+            if matched:
+                matched_count += 1
+            else:
+                unmatched_count += 1
+            if finding is not None:
+                underutilized_storage_accounts.append(finding)
 
     # --- Subnet analysis (after main resource loop) ---
     for vnet in network_client.virtual_networks.list_all():
         vnet_id_parts = vnet.id.split("/")
         resource_group_name = vnet_id_parts[4]
-        for subnet in network_client.subnets.list(resource_group_name, vnet.name):
+        tags = vnet.tags or {}
+        # list_all() already hydrates each VNet's subnets (prefix and ip
+        # configurations included), so no per-VNet subnets.list round trip.
+        for subnet in vnet.subnets or []:
             # Exclude default subnets
             if "default" in subnet.name.lower():
                 print(f"  • {subnet.name} (Default VPC) - Skipped")
@@ -406,37 +397,17 @@ def analyze_azure_resources():
             print(f"  • {subnet.name} (VNet: {vnet.name}) - {free_percent:.2f}% free IPs")
             if free_percent > SUBNET_FREE_IP_THRESHOLD:
                 # Build formatted_resource for subnet using the same structure as storage accounts
-                formatted_resource = {
-                    "_id": subnet.id,
-                    "CloudProvider": "Azure",
-                    "ManagementUnitId": subscription_id,
-                    "ApplicationCode": tags.get("ApplicationCode", "na").lower(),
-                    "CostCenter": tags.get("CostCenter", "na").lower(),
-                    "CIO": tags.get("CIO", "na").lower(),
-                    "Platform": tags.get("Platform", "na").lower(),
-                    "Lab": tags.get("Lab", "na").lower(),
-                    "Feature": tags.get("Feature", "na").lower(),
-                    "Owner": tags.get("Owner", "na").lower(),
-                    "TicketId": tags.get("Ticket", "na").lower(),
-                    "ResourceType": "Network",
-                    "SubResourceType": "subnet",
-                    "ResourceName": subnet.name,
-                    "Region": vnet.location if vnet.location else "na",
-                    "TotalCost": "na",
-                    "Currency": tags.get("Currency", "usd").upper(),
-                    "Finding": "subnet underutilised",
-                    "Recommendation": "scale down",
-                    "Environment": tags.get("Environment", "na").lower(),
-                    "Timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-                    "ConfidenceScore": tags.get("ConfidenceScore", "na"),
-                    "Status": "available",
-                    "Entity": tags.get("Entity", "na").lower(),
-                    "RootId": tenant_id,
-                    "Email": env.get("email", ""),
-                    "Current_Free_IP_Percent": free_percent,
-                    "VNet": vnet.name,
-                    "ResourceGroup": resource_group_name
-                }
+                formatted_resource = make_finding(
+                    subnet.id, subnet.name, vnet.location, tags,
+                    ResourceType="Network",
+                    SubResourceType="subnet",
+                    Finding="subnet underutilised",
+                    Recommendation="scale down",
+                    Status="available",
+                    Current_Free_IP_Percent=free_percent,
+                    VNet=vnet.name,
+                    ResourceGroup=resource_group_name
+                )
                 underutilized_storage_accounts.append(formatted_resource)
                 print(f"  ⚠️  {subnet.name} (VNet: {vnet.name}) - {free_percent:.2f}% free IPs (flagged)")
 
@@ -476,15 +447,25 @@ def analyze_azure_resources():
         # Clear existing records from the collection before inserting new data
         existing_count = cost_insights_collection.count_documents(filter_query)
         if existing_count > 0:
-            cost_insights_collection.delete_many({})
+            cost_insights_collection.delete_many(filter_query)
             print(f"[INFO] Cleared {existing_count} existing records from Cost_Insights collection")
         else:
             print("[INFO] Collection is empty, no records to clear")
-            
-        # Insert underutilized storage accounts into database
+
+        # Upsert in bounded batches: one wire message per 1000 docs, and
+        # ordered=False lets the server apply them without head-of-line stalls.
         if underutilized_storage_accounts:
-            cost_insights_collection.insert_many(underutilized_storage_accounts)
-            print(f"[INFO] Inserted {len(underutilized_storage_accounts)} underutilized storage accounts into database")
+            ops = [
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {k: v for k, v in doc.items() if k != "_id"}},
+                    upsert=True
+                )
+                for doc in underutilized_storage_accounts
+            ]
+            for i in range(0, len(ops), BULK_WRITE_BATCH_SIZE):
+                cost_insights_collection.bulk_write(ops[i:i + BULK_WRITE_BATCH_SIZE], ordered=False)
+            print(f"[INFO] Upserted {len(underutilized_storage_accounts)} underutilized storage accounts into database")
         else:
             print("[INFO] No underutilized storage accounts found to insert")
             
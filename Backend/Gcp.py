@@ -70,61 +70,69 @@ sub_resource_mapping = {
 # ================================================================================
 # ARGUMENT PARSING
 # ================================================================================
-parser = argparse.ArgumentParser(description="GCP Resource Optimization Script")
-# Use '--client_email' consistently for the service account
-parser.add_argument("--client_email", required=True, help="GCP Service Account Client Email (for authentication)")
-parser.add_argument("--private_key", required=True, help="GCP Service Account Private Key. Replace newlines with '\\n'.")
-parser.add_argument("--project_id", required=True, help="GCP Project ID to analyze")
-# Use '--user_email' consistently for the user's email
-parser.add_argument("--user_email", required=True, help="User Email for fetching configs from MongoDB and for reports")
-args = parser.parse_args()
-
-
-PROJECT_ID = args.project_id
-USER_EMAIL = args.user_email  # Use the email from command line consistently
-
-print("GCP Resource Optimization Analysis")
-print("=" * 80)
-print(f"Project to Analyze: {PROJECT_ID}")
-print(f"Configuration for User Email: {USER_EMAIL}")
-print(f"Authenticating with Service Account: {args.client_email}")
-print("=" * 80)
-
-# ================================================================================
-# AUTHENTICATION
-# ================================================================================
-try:
-    pk_string = args.private_key.replace('\\n', '\n')
-    credentials_info = {
-        "type": "service_account",
-        "project_id": PROJECT_ID,
-        "private_key": pk_string,
-        "client_email": args.client_email,
-        "token_uri": "https://oauth2.googleapis.com/token",
-        "scopes": ["https://www.googleapis.com/auth/cloud-platform"]
-    }
-    gcp_credentials = service_account.Credentials.from_service_account_info(credentials_info)
-    print("Authentication successful.")
-
-    compute = discovery.build('compute', 'v1', credentials=gcp_credentials)
-    monitoring_client = monitoring_v3.MetricServiceClient(credentials=gcp_credentials)
-    asset_client = asset_v1.AssetServiceClient(credentials=gcp_credentials)
-    billing_client = discovery.build('cloudbilling', 'v1', credentials=gcp_credentials)
-    sql_client = discovery.build('sqladmin', 'v1beta4', credentials=gcp_credentials)
-    recommender_client_service = discovery.build('recommender', 'v1', credentials=gcp_credentials)
-    run_admin_client = discovery.build('run', 'v1', credentials=gcp_credentials) # <--- ADD THIS LINE
-    artifact_registry_client = discovery.build('artifactregistry', 'v1', credentials=gcp_credentials)
-    storage_client = gcs_storage.Client(credentials=gcp_credentials, project=PROJECT_ID)
-
-    print("All GCP clients initialized.")
+# Identity/credential/client globals are populated by _init_clients(), either via
+# run() (in-process invocation from Agent.py) or via the CLI shim at the bottom.
+PROJECT_ID = None
+USER_EMAIL = None
+gcp_credentials = None
+compute = None
+monitoring_client = None
+asset_client = None
+billing_client = None
+sql_client = None
+recommender_client_service = None
+run_admin_client = None
+artifact_registry_client = None
+storage_client = None
+
+
+def _init_clients(client_email, private_key, project_id, user_email):
+    """Authenticate and build the module-level GCP clients (previously import-time)."""
+    global PROJECT_ID, USER_EMAIL, gcp_credentials, compute, monitoring_client, asset_client
+    global billing_client, sql_client, recommender_client_service, run_admin_client
+    global artifact_registry_client, storage_client
+
+    PROJECT_ID = project_id
+    USER_EMAIL = user_email  # Use the caller-supplied email consistently
+
+    print("GCP Resource Optimization Analysis")
+    print("=" * 80)
+    print(f"Project to Analyze: {PROJECT_ID}")
+    print(f"Configuration for User Email: {USER_EMAIL}")
+    print(f"Authenticating with Service Account: {client_email}")
+    print("=" * 80)
+
+    # ================================================================================
+    # AUTHENTICATION
+    # ================================================================================
+    try:
+        pk_string = private_key.replace('\\n', '\n')
+        credentials_info = {
+            "type": "service_account",
+            "project_id": PROJECT_ID,
+            "private_key": pk_string,
+            "client_email": client_email,
+            "token_uri": "https://oauth2.googleapis.com/token",
+            "scopes": ["https://www.googleapis.com/auth/cloud-platform"]
+        }
+        gcp_credentials = service_account.Credentials.from_service_account_info(credentials_info)
+        print("Authentication successful.")
 
-except Exception as e:
-    print(f"Critical Error: Failed to create credentials from arguments. Please check your inputs. Error: {e}")
-    exit(1)
+        compute = discovery.build('compute', 'v1', credentials=gcp_credentials)
+        monitoring_client = monitoring_v3.MetricServiceClient(credentials=gcp_credentials)
+        asset_client = asset_v1.AssetServiceClient(credentials=gcp_credentials)
+        billing_client = discovery.build('cloudbilling', 'v1', credentials=gcp_credentials)
+        sql_client = discovery.build('sqladmin', 'v1beta4', credentials=gcp_credentials)
+        recommender_client_service = discovery.build('recommender', 'v1', credentials=gcp_credentials)
+        run_admin_client = discovery.build('run', 'v1', credentials=gcp_credentials)
+        artifact_registry_client = discovery.build('artifactregistry', 'v1', credentials=gcp_credentials)
+        storage_client = gcs_storage.Client(credentials=gcp_credentials, project=PROJECT_ID)
 
+        print("All GCP clients initialized.")
 
-# Initialize the global compute client with the new credentials
-compute = discovery.build('compute', 'v1', credentials=gcp_credentials)
+    except Exception as e:
+        print(f"Critical Error: Failed to create credentials from arguments. Please check your inputs. Error: {e}")
+        raise
 
 # ================================================================================
 # MONGODB INTEGRATION (Conditional Import)
@@ -3307,7 +3315,7 @@ def extract_resource_metadata(labels, resource_name, resource_type, region, full
 # MAIN EXECUTION
 # ================================================================================
 
-if __name__ == "__main__":
+def _main():
     try:
         # Stage 1: Dynamic Setup and Configuration
         print("\n--- Step 1: Initializing Configuration ---")
@@ -3389,3 +3397,25 @@ if __name__ == "__main__":
         print(f"\nA critical error occurred during the main execution: {e}")
     except KeyboardInterrupt:
         print("\nAnalysis interrupted by user.")
+
+
+def run(client_email, private_key, project_id, user_email):
+    """Entry point for in-process invocation (e.g. from Agent.py's worker pool).
+
+    Skips interpreter startup and the heavyweight SDK imports on every scan.
+    """
+    _init_clients(client_email, private_key, project_id, user_email)
+    _main()
+
+
+if __name__ == "__main__":
+    # Thin CLI shim around run()
+    parser = argparse.ArgumentParser(description="GCP Resource Optimization Script")
+    # Use '--client_email' consistently for the service account
+    parser.add_argument("--client_email", required=True, help="GCP Service Account Client Email (for authentication)")
+    parser.add_argument("--private_key", required=True, help="GCP Service Account Private Key. Replace newlines with '\\n'.")
+    parser.add_argument("--project_id", required=True, help="GCP Project ID to analyze")
+    # Use '--user_email' consistently for the user's email
+    parser.add_argument("--user_email", required=True, help="User Email for fetching configs from MongoDB and for reports")
+    args = parser.parse_args()
+    run(args.client_email, args.private_key, args.project_id, args.user_email)
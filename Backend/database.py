@@ -23,4 +23,5 @@ users_collection = db["users"]
 resources_collection = db["Cost_Insights"]
 standard_config_collection = db["standardConfigsDb"]  # <-- Corrected name
 users_signup_collection = db["signupdata"]
-triggers_collection = db["triggers"]
\ No newline at end of file
+triggers_collection = db["triggers"]
+trigger_events_collection = db["trigger_events"]
\ No newline at end of file
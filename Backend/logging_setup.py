@@ -58,6 +58,10 @@ class SizeRotatingFileHandler(logging.FileHandler):
 
 def setup_logging():
     logger = logging.getLogger("AgentLogger")
+    # Idempotent: a second call would re-open the file handler and double
+    # every log write.
+    if any(isinstance(h, SizeRotatingFileHandler) for h in logger.handlers):
+        return
     logger.setLevel(logging.DEBUG)
     # Remove all handlers
     for h in logger.handlers[:]:
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Query,Request,UploadFile, File, Form
 from models import User,BulkSignupRequest, Resource, StandardConfig, SignupUser , Trigger,SigninUser
-from database import users_collection,usersEnvironmentOnboarding_collection, get_db, users_signup_collection, resources_collection , triggers_collection
+from database import users_collection,usersEnvironmentOnboarding_collection, get_db, users_signup_collection, resources_collection , triggers_collection, trigger_events_collection
 from fastapi.encoders import jsonable_encoder
 from typing import List, Optional
 from datetime import datetime, timezone
@@ -283,6 +283,12 @@ async def create_trigger(trigger: Trigger):
         "Status": "Pending"
     }
     result = triggers_collection.insert_one(data)
+    # Append a marker into the capped trigger_events collection so the agent's
+    # tailable cursor wakes up without scanning the triggers collection.
+    try:
+        trigger_events_collection.insert_one({"_id": result.inserted_id})
+    except Exception as e:
+        print(f"Failed to write trigger_events marker: {e}")
     data["_id"] = str(result.inserted_id)
     return {"message": "Schedule saved", "data": data}
 